@@ -0,0 +1,321 @@
+"""
+Benchmark the loaders against synthetic CRP files.
+
+Writes realistic pipe-quoted bulk files and a CRP_IDs.xls at a chosen scale,
+runs every downloader's load jobs over them and reports rows, wall time,
+rows/sec and peak RSS per table, each table loaded in a process of its own.
+By default the rows go to a stand-in cursor that reads and counts everything
+MySQL would have been sent; pass --mysql to load into the database
+configured in credentials.py instead.
+
+python bench.py --scale=10
+python bench.py --scale=50 --mysql --dir=/tmp/crpbench
+"""
+
+import copy
+import logging
+import os
+import random
+import re
+import resource
+import sys
+import time
+from multiprocessing import Pool
+
+from campfin import CampFinDownloader
+from expends import ExpendsDownloader
+from lobby import LobbyDownloader
+from extras import ExtrasDownloader
+
+
+#rows per unit of --scale
+ROWS = {
+    'indivs': 10000,
+    'pacs': 1000,
+    'pac_other': 1000,
+    'expends': 2000,
+    'lob_lobbying': 500,
+    'lob_lobbyist': 1000,
+    'lob_indus': 100,
+    'lob_agency': 1000,
+    'lob_issue': 1000,
+    'lob_bills': 1000,
+    'lob_rpt': 10,
+}
+
+LASTNAMES = ['SMITH', 'JOHNSON', 'WILLIAMS', 'BROWN', 'JONES', 'GARCIA', 'MILLER', 'DAVIS', 'RODRIGUEZ', 'MARTINEZ', "O'BRIEN", 'NGUYEN']
+FIRSTNAMES = ['JOHN', 'MARY', 'ROBERT', 'PATRICIA', 'MICHAEL', 'LINDA', 'WILLIAM', 'ELIZABETH', 'DAVID', 'JOSE']
+ORGS = ['Goldman Sachs', 'Microsoft Corp', 'Retired', 'Self-Employed', 'Univ of California', 'Kirkland & Ellis', 'Exxon Mobil', 'Boeing Co', 'Homemaker', 'None']
+CITIES = [('WASHINGTON', 'DC', '20001'), ('NEW YORK', 'NY', '10021'), ('LOS ANGELES', 'CA', '90049'), ('HOUSTON', 'TX', '77002'), ('CHICAGO', 'IL', '60611')]
+REALCODES = ['F2100', 'C5120', 'X1200', 'K1000', 'H1100', 'E1110', 'D2000', 'Y4000', 'J1200', 'Z9000']
+EXPCODES = ['A00', 'A10', 'C20', 'F40', 'M10', 'R20', 'T10', 'U10']
+PARTIES = ['D', 'R', 'I', '3']
+
+
+def q(value):
+    return '|%s|' % value
+
+
+def date(year):
+    return '%02i/%02i/%s' % (random.randint(1, 12), random.randint(1, 28), year)
+
+
+def cid():
+    return 'N%08i' % random.randint(1, 99999)
+
+
+def cmteid():
+    return 'C%08i' % random.randint(1, 99999)
+
+
+def indivs(cycle, i):
+    last, first = random.choice(LASTNAMES), random.choice(FIRSTNAMES)
+    city, state, zipcode = random.choice(CITIES)
+    org = random.choice(ORGS)
+    return [q(cycle), q('%07i' % i), q('h%010i%s' % (random.randint(1, 99999), random.choice(' 1'))), q('%s, %s' % (last, first)),
+        q(cid()), q(org), q(org), q(random.choice(REALCODES)), date(int(cycle) - 1), str(random.choice([250, 500, 1000, 2300, 2400])),
+        q(''), q(city), q(state), q(zipcode), q(random.choice(['DI', 'RW', 'DL'])), q('15'), q(cmteid()), q(''), q(random.choice('MFU')),
+        q('ATTORNEY/%s' % org), q('%011i' % i), q('Attorney'), q(org), q('P/PAC')]
+
+
+def pacs(cycle, i):
+    return [q(cycle), q('%07i' % i), q(cmteid()), q(cid()), str(random.randint(250, 10000)), date(cycle),
+        q(random.choice(REALCODES)), q('24K'), q(random.choice('DI')), q('H0CA%05i' % i)]
+
+
+def pac_other(cycle, i):
+    city, state, zipcode = random.choice(CITIES)
+    return [q(cycle), q('%07i' % i), q(cmteid()), q('Committee %i' % i), q(random.choice(ORGS)), q(city), q(state), q(zipcode),
+        q(''), q(random.choice(REALCODES)), date(cycle), str(random.randint(250, 10000)), q(cmteid()), q(random.choice(PARTIES)),
+        q(''), q('PB'), q(random.choice(REALCODES)), q('N'), q('Q3'), q('P'), q('%011i' % i), q('24K'), q(random.choice(REALCODES)), q('PAC')]
+
+
+def expends(cycle, i):
+    city, state, zipcode = random.choice(CITIES)
+    return [q(cycle), str(i), q('SB%07i' % i), q(cmteid()), q('DI'), q('Committee %i' % (i % 500)), q(random.choice(ORGS)),
+        q(random.choice(EXPCODES)), str(random.randint(10, 50000)), date(cycle), q(city), q(state), q(zipcode), q(cmteid()),
+        q('H0CA%05i' % i), q('17'), q('Consulting fees'), q('P2010'), q(''), q('ORG'), q('F3')]
+
+
+def lob_lobbying(cycle, i):
+    year = str(2000 + i % 12)
+    return [q('D%055i' % i), q('Patton Boggs LLP'), q('Patton Boggs'), q('y'), q('Client %i' % i), q('Client %i' % i), q(random.choice(ORGS)),
+        str(random.randint(10000, 500000)), q(random.choice(REALCODES)), q('Y'), q('n'), q('n'), q('y'), q('y'), q(year), q('q1'),
+        q('FIRST QUARTER REPORT'), q('D%09i' % i), q('n')]
+
+
+def lob_lobbyist(cycle, i):
+    last, first = random.choice(LASTNAMES), random.choice(FIRSTNAMES)
+    return [q('D%055i' % (i % (ROWS['lob_lobbying'] or 1))), q('%s, %s' % (last, first)), q('%s, %s' % (last, first)), q('Y%014i' % i),
+        q(str(2000 + i % 12)), q('Chief of Staff'), q(cid()), q('n')]
+
+
+def lob_indus(cycle, i):
+    return [q('Client %i' % i), q(random.choice(ORGS)), str(random.randint(10000, 500000)), q(str(2000 + i % 12)), q(random.choice(REALCODES))]
+
+
+def lob_agency(cycle, i):
+    return [q('D%055i' % (i % (ROWS['lob_lobbying'] or 1))), q('%03i' % (i % 250)), q('Dept of Agency %i' % (i % 250))]
+
+
+def lob_issue(cycle, i):
+    return [str(i), q('D%055i' % (i % (ROWS['lob_lobbying'] or 1))), q('TAX'), q('Taxes'), q('Tax reform, corporate rates'), q(str(2000 + i % 12))]
+
+
+def lob_bills(cycle, i):
+    return [str(i), str(i), q('111'), q('H.R.%i' % i)]
+
+
+def lob_rpt(cycle, i):
+    return [q('REPORT TYPE %i' % i), q('q%i' % i)]
+
+
+GENERATORS = {
+    'indivs': indivs, 'pacs': pacs, 'pac_other': pac_other, 'expends': expends,
+    'lob_lobbying': lob_lobbying, 'lob_lobbyist': lob_lobbyist, 'lob_indus': lob_indus, 'lob_agency': lob_agency,
+    'lob_issue': lob_issue, 'lob_bills': lob_bills, 'lob_rpt': lob_rpt,
+}
+
+
+def writefile(path, generator, cycle, rows):
+    outfile = open(path, 'w')
+    for i in xrange(rows):
+        outfile.write(','.join(generator(cycle, i)) + '\r\n')
+    outfile.close()
+
+
+def writeids(path):
+    import pyExcelerator
+    book = pyExcelerator.Workbook()
+    sheets = [
+        ('Members 112th', ['CID', 'CRPName', 'Party', 'Office'], lambda i: [cid(), '%s (%s)' % (random.choice(LASTNAMES), random.choice(PARTIES)), random.choice(PARTIES), 'CA%02i' % (i % 53)]),
+        ('CRP Industry Codes', ['Catcode', 'Catname', 'Catorder', 'Industry', 'Sector', 'Sector Long'], lambda i: [REALCODES[i % len(REALCODES)], 'Category %i' % i, 'A%02i' % i, 'Industry %i' % i, 'Sector', 'Sector long name']),
+        ('Congressional Cmte Codes', ['Code', 'Title'], lambda i: ['HAPP%i' % i, 'Appropriations %i' % i]),
+        ('Congressional Cmte Assignments', ['CID', 'Name', 'Congno', 'Code', 'Position'], lambda i: [cid(), random.choice(LASTNAMES), '112', 'HAPP%i' % (i % 20), 'Member']),
+    ]
+    for name, header, generator in sheets:
+        sheet = book.add_sheet(name)
+        for row_idx, row in enumerate([header] + [generator(i) for i in range(535)]):
+            #CRP leaves column 1 of the members sheet empty
+            values = row
+            if name.startswith('Members'):
+                values = row[:1] + [''] + row[1:]
+            for col_idx, value in enumerate(values):
+                sheet.write(row_idx, col_idx, value)
+    book.save(path)
+
+
+def generate(path, scale, cycles):
+    if not os.path.exists(path):
+        os.makedirs(path)
+    random.seed(2012)
+    for table, rows in ROWS.items():
+        rows = int(rows * scale)
+        if table.startswith('lob_'):
+            writefile(os.path.join(path, table + '.txt'), GENERATORS[table], None, rows)
+        else:
+            for year in cycles:
+                writefile(os.path.join(path, table + year + '.txt'), GENERATORS[table], '20' + year, rows)
+    writeids(os.path.join(path, 'CRP_IDs.xls'))
+
+
+class StandInCursor(object):
+    """Takes the place of a MySQLdb cursor. Files named in LOAD DATA are read
+    to the end, just as the client library would send them to the server."""
+
+    infile_re = re.compile(r"LOAD DATA LOCAL INFILE '([^']+)'", re.I)
+
+    def __init__(self):
+        self.rowcount = 0
+        self.result = None
+
+    def execute(self, sql, args=None):
+        self.rowcount = 0
+        self.result = None
+        if sql.upper().startswith('SELECT COUNT(*)'):
+            self.result = (0,)
+        m = self.infile_re.match(sql)
+        if m:
+            infile = open(m.group(1), 'rb')
+            for line in infile:
+                self.rowcount += 1
+            infile.close()
+        elif sql.lstrip().upper().startswith('INSERT'):
+            self.rowcount = 1
+
+    def executemany(self, sql, rows):
+        self.rowcount = len(rows)
+
+    def fetchone(self):
+        return self.result
+
+    def fetchall(self):
+        return []
+
+
+class CountingCursor(object):
+    """Wraps a cursor and adds up the rows each statement wrote."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.rows = 0
+
+    def execute(self, sql, args=None):
+        self.cursor.execute(sql, args)
+        if sql.lstrip().upper().startswith(('INSERT', 'LOAD', 'REPLACE')) and 'crp_loads' not in sql:
+            self.rows += max(self.cursor.rowcount, 0)
+
+    def executemany(self, sql, rows):
+        self.cursor.executemany(sql, rows)
+        self.rows += max(self.cursor.rowcount, 0)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+def peakrss():
+    #ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def measure(job):
+    """Runs one load job in a child process of its own, so its peak RSS is that
+    job's alone rather than the largest of every job run before it."""
+    loader, table, year, mysql = job
+    if mysql:
+        from loader import connect
+        db = connect()
+        cursor = db.cursor()
+    else:
+        cursor = StandInCursor()
+    counter = CountingCursor(cursor)
+    loader = copy.copy(loader)
+    loader.cursor = counter
+    start = time.time()
+    loader.load(table, year)
+    elapsed = time.time() - start
+    if mysql:
+        db.commit()
+        db.close()
+    return counter.rows, elapsed, peakrss()
+
+
+def run(path, cycles, cursor, mysql=False):
+    loaders = [
+        CampFinDownloader(cursor, path, cycles, tables=['indivs', 'pacs', 'pac_other']),
+        ExpendsDownloader(cursor, path, cycles),
+        LobbyDownloader(cursor, path),
+        ExtrasDownloader(cursor, path, cycles, tables=['ids']),
+    ]
+    results = []
+    for loader in loaders:
+        loader.force = True
+        loader.setup()
+        if mysql:
+            #the child processes load on connections of their own
+            cursor.connection.commit()
+        for table, year in loader.jobs():
+            pool = Pool(1)
+            try:
+                rows, elapsed, rss = pool.apply(measure, [(loader, table, year, mysql)])
+            finally:
+                pool.close()
+                pool.join()
+            results.append((table + (year or ''), rows, elapsed, rss))
+    return results
+
+
+def report(results):
+    print "%-16s %10s %9s %12s %10s" % ('table', 'rows', 'seconds', 'rows/sec', 'peak MB')
+    for name, rows, elapsed, rss in results:
+        print "%-16s %10i %9.2f %12.0f %10.1f" % (name, rows, elapsed, rows / max(elapsed, 1e-6), rss)
+
+
+if __name__ == '__main__':
+    scale = 1.0
+    path = 'bench'
+    mysql = False
+    cycles = ['10', '12']
+    for arg in sys.argv[1:]:
+        if arg.startswith('--scale='):
+            scale = float(arg.split('=', 1)[1])
+        elif arg.startswith('--dir='):
+            path = arg.split('=', 1)[1]
+        elif arg == '--mysql':
+            mysql = True
+
+    logging.basicConfig(level=logging.WARNING)
+
+    start = time.time()
+    generate(path, scale, cycles)
+    print "generated scale %s fixtures in %s (%.1fs)" % (scale, path, time.time() - start)
+
+    if mysql:
+        from loader import connect
+        db = connect()
+        cursor = db.cursor()
+    else:
+        cursor = StandInCursor()
+    report(run(path, cycles, cursor, mysql))
+    if mysql:
+        db.commit()
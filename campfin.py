@@ -15,20 +15,194 @@ Luke Rosiak
 """
 
 import sys
-import csv
+import collections
+import cStringIO
 import datetime
 import logging
 import os
 import re
+from multiprocessing import Pool, current_process
 
+from crpformat import readbatches, readchunks, splitchunks, chunkbounds, readchunk, parsechunk, CHUNK_SIZE
+from donors import DonorIndexBuilder, DONOR_PATH, donorkeys
+from delta import DeltaState, ChangeFeed, DELTA_PATH, KEY_SIZE, entry, keyfits, diff, printablekey
+from compact import encodeknown
+from loader import Loader, BatchInserter, StagingFile, loadstaged, loadcrp, columnlist, BATCH_SIZE
+from metrics import metrics
+from quarantine import Quarantine, bywidth
+from source import RawSource, fifo
 
-class CampFinDownloader(object):
+#fields in a line of indivsYY.txt; splitindivs derives the last four columns
+INDIVS_WIDTH = 24
+INDIVS_COLS = ['Cycle','FECTransID','ContribID','Contrib','RecipID','Orgname','UltOrg','RealCode','Date','Amount','street','City','State','Zip','Recipcode','Type','CmteID','OtherID','Gender','FECOccEmp','Microfilm','Occ_EF','Emp_EF','Src','lastname','first','first3','fam']
+
+#column lists for the tables LOAD DATA can take straight from the CRP files
+LOAD_COLUMNS = {
+    'cmtes': "",
+    'cands': "",
+    'pacs': "(Cycle,FECRecNo,PACID,CID,Amount,@Date_orig,RealCode,Type,DI,FECCandID) SET Date = STR_TO_DATE(@Date_orig, '%m/%d/%Y')",
+    'pac_other': "(Cycle,FECRecNo,FilerID,DonorCmte,ContribLendTrans,City,State,Zip,FECOccEmp,PrimCode,@Date_orig,Amount,RecipID,Party,OtherID,RecipCode,RecipPrimcode,Amend,Report,PG,Microfilm,Type,Realcode,Source) SET Date = STR_TO_DATE(@Date_orig, '%m/%d/%Y')",
+}
+
+
+#for the tables delta mode loads row by row: the key field in the CRP file and
+#the column it is deleted by; rows without a key field are keyed on their hash
+DELTA_KEYS = {
+    'indivs': (1, 'FECTransID'),
+    'pacs': (None, 'RowKey'),
+    'pac_other': (None, 'RowKey'),
+}
+
+
+def deltacolumns(table):
+    #the columns a delta load stages, and the SET clause after them
+    if table == 'indivs':
+        return INDIVS_COLS, ''
+    cols, clause = columnlist(LOAD_COLUMNS[table])
+    return cols + ['RowKey'], clause
+
+
+def reformatdate(date):
+    return date[6:] + '-' + date[:2] + '-' + date[3:5]
+
+
+def splitindivs(row):
+    #split contrib and fam
+    lastname = row[3].split(', ')[0]
+    first = row[3][len(lastname)+2:]
+    row.append(lastname)
+    row.append(first)
+    row.append(first[:3])
+    row.append(row[2][11:]) #family member identifier
+    row[2] = row[2][:11]   #family identifier
+    row[8] = reformatdate(row[8])
+    return row
+
+
+def splitbatch(rows, quarantine):
+    #a row of the wrong width would split into the wrong columns, or not at all
+    rows, rejected = bywidth(rows, INDIVS_WIDTH)
+    for row in rejected:
+        quarantine.reject(row, 'width')
+    return [splitindivs(row) for row in rows]
+
+
+def stageindivs(infile, outfile, stage=None, quarantine=None, donors=None, encoder=None):
+    """Rewrites indivsYY.txt into a form LOAD DATA can take as-is, with the
+    derived name columns and ISO dates already filled in. The rows' donor keys
+    go to donors, a DonorIndexBuilder, if given, and their codes are encoded
+    by encoder for the compact form."""
+    quarantine = quarantine or Quarantine('indivs')
+    staged = StagingFile(outfile, stage)
+    for rows in readbatches(infile):
+        rows = splitbatch(rows, quarantine)
+        if donors:
+            donors.add([donorkeys(row) for row in rows])
+        if encoder:
+            encoder.encode(rows)
+        staged.addbatch(rows)
+    staged.close()
+    return staged.count
+
+
+def stagechunk(job):
+    #runs in a pool worker: one chunk of indivsYY.txt, staged in memory; rejected
+    #rows are sent back for the parent's quarantine, with the donor keys if wanted;
+    #codes are encoded from the parent's snapshot, rows with new ones go back unstaged.
+    #chunk is (path, start, end) to read from disk, or the chunk's raw text
+    chunk, keys, fields, codes = job
+    out = cStringIO.StringIO()
+    staged = StagingFile(out)
+    if isinstance(chunk, tuple):
+        rows = readchunk(*chunk)
+    else:
+        rows = parsechunk(chunk)
+    rows, rejected = bywidth(rows, INDIVS_WIDTH)
+    rows = [splitindivs(row) for row in rows]
+    keys = keys and [donorkeys(row) for row in rows]
+    pending = []
+    if fields:
+        rows, pending = encodeknown(rows, fields, codes)
+    staged.addbatch(rows)
+    return staged.count, out.getvalue(), rejected, keys, pending
+
+
+def stageparallel(path, outfile, workers, stage=None, quarantine=None, donors=None, encoder=None, infile=None):
+    """stageindivs spread over a pool of processes. A file on disk at path is
+    cut into chunks of about CHUNK_SIZE on record boundaries that the workers
+    read for themselves; without a path, as for a zip member, infile is read
+    here a chunk at a time and the chunks are handed out. Only a few chunks are
+    in hand at once, so however big the file, memory use stays about the same."""
+    quarantine = quarantine or Quarantine('indivs')
+    if path:
+        #chunks of about CHUNK_SIZE however big the file, so each worker holds little at once
+        bounds = chunkbounds(path, max(workers * 4, os.path.getsize(path) / CHUNK_SIZE))
+        chunks = [(path, start, end) for start, end in zip(bounds, bounds[1:])]
+    else:
+        chunks = (text for offset, text in splitchunks(infile))
+    fields, codes = encoder and (encoder.fields, encoder.codes) or (None, None)
+
+    def results(pool):
+        waiting = collections.deque()
+        for chunk in chunks:
+            waiting.append(pool.apply_async(stagechunk, [(chunk, bool(donors), fields, codes)]))
+            if len(waiting) > workers * 2:
+                yield waiting.popleft().get()
+        while waiting:
+            yield waiting.popleft().get()
+
+    pool = Pool(workers)
+    count = 0
+    try:
+        for rows, data, rejected, keys, pending in results(pool):
+            for row in rejected:
+                quarantine.reject(row, 'width')
+            if donors:
+                donors.add(keys)
+            if pending:
+                staged = StagingFile(outfile, stage)
+                staged.addbatch(encoder.encode(pending))
+                count += staged.count
+            outfile.write(data)
+            count += rows
+            if stage:
+                stage.add(rows=rows, bytes=len(data))
+    finally:
+        pool.close()
+        pool.join()
+    logging.info("Staged %i rows" % count)
+    return count
+
+
+class CampFinDownloader(Loader):
+
+    #cmtes, cands and indivs can be loaded as well by passing them in tables
+    TABLES = ['pacs', 'pac_other']
+    OPTIONAL = ['cmtes', 'cands', 'indivs']
+    PARTITIONED = ['indivs', 'pacs', 'pac_other']
+    RESOURCE = 'CampaignFin'
+    #apply just the rows that changed since the last load
+    delta = False
+    delta_path = DELTA_PATH
+    #keep a donor index of each indivs cycle loaded
+    donors = False
+    donor_path = DONOR_PATH
+    #bytes of indivsYY.txt committed at a time with resume set
+    checkpoint_size = CHUNK_SIZE
     
-    def __init__(self,cursor,path,cycles):
+    def __init__(self,cursor,path,cycles,batch_size=BATCH_SIZE,staging=True,tables=None,archives=None,manifest=None,parse_workers=1):
         
         self.cursor = cursor
         self.dest_path = path
+        self.source = RawSource(path, archives, manifest)
         self.cycles = cycles
+        self.tables = tables or self.TABLES
+        for table in self.tables:
+            if table not in self.TABLES + self.OPTIONAL:
+                raise ValueError("Unknown campaign finance table %s, use any of %s" % (table, ', '.join(self.OPTIONAL + self.TABLES)))
+        self.batch_size = batch_size
+        self.staging = staging
+        self.parse_workers = parse_workers
 
 
     def createtables(self):
@@ -144,74 +318,260 @@ class CampFinDownloader(object):
 
 
 
-    def populatetables(self):
+    def writerowsfromcsv(self, file, table, donors=None):
+        self.writerows(readbatches(file, self.batch_size), table, donors)
 
-        def writerowsfromcsv(file, table):
-            def linereader(path):
-                infile = open(path, 'rU')
-                for line in infile:
-                    line = unicode(line, 'ascii', 'ignore').replace('\n', '')
-                    yield line
-                infile.close()
-            
-            detailReader =  csv.reader(linereader(file), quotechar='|')
-            writerows(detailReader, table)
 
-        def writerows(rows, table):
+    def writerows(self, batches, table, donors=None):
+        logging.info("Writing " + table)
+        cols = None
+        encoder = None
+        if table=='indivs':
+            cols = INDIVS_COLS
+            encoder = self.encoder(table, cols)
+        inserter = BatchInserter(self.cursor, self.target("crp_" + table), cols, self.batch_size, self.progress, self.quarantine)
+        try:
+            for rows in batches:
+                if table=='indivs':
+                    rows = splitbatch(rows, inserter.quarantine)
+                    if donors:
+                        donors.add([donorkeys(row) for row in rows])
+                    if encoder:
+                        encoder.encode(rows)
+                inserter.addbatch(rows)
+            inserter.close()
+        finally:
+            if encoder:
+                encoder.close()
 
-            def reformatdate(date):
-                return date[6:] + '-' + date[:2] + '-' + date[3:5]
-            logging.info("Writing " + table)
+
+    def donorindex(self):
+        #a builder for the job's donor index, if one is kept
+        return self.donors and DonorIndexBuilder() or None
+
+
+    def savedonors(self, donors, year):
+        if donors:
+            path = os.path.join(self.donor_path, "indivs%s.donors" % year)
+            donors.save(path)
+            logging.info("Wrote donor index %s of %i rows" % (path, len(donors.transids)))
+
+
+    def loadindivs(self, name, year):
+        donors = self.donorindex()
+        if not self.staging:
+            self.writerowsfromcsv(self.source.open(name, 'rb'), "indivs", donors)
+            self.savedonors(donors, year)
+            return
+        logging.info("Staging " + name)
+        path = self.source.filepath(name)
+        parallel = self.parse_workers > 1
+        if parallel and current_process().daemon:
+            #a scheduler worker process can't start a pool of its own
+            logging.info("Parsing %s in one process inside a load worker" % name)
+            parallel = False
+        encoder = self.encoder('indivs', INDIVS_COLS)
+        def stage(outfile):
+            with metrics.stage('parse', name) as parsed:
+                if parallel:
+                    #a zip member is read here and its chunks handed to the workers
+                    infile = path is None and self.source.open(name, 'rb') or None
+                    stageparallel(path, outfile, self.parse_workers, parsed, self.quarantine, donors, encoder, infile)
+                else:
+                    stageindivs(self.source.open(name, 'rb'), outfile, parsed, self.quarantine, donors, encoder)
+        try:
+            with fifo(stage) as staged:
+                self.progress.add(rows=loadstaged(self.cursor, staged, self.target("crp_indivs"), INDIVS_COLS, quarantine=self.quarantine))
+        finally:
+            if encoder:
+                encoder.close()
+        self.savedonors(donors, year)
+
+
+    def loadchunk(self, rows):
+        #one chunk's rows, split and encoded; returns the number loaded
+        if not self.staging:
+            inserter = BatchInserter(self.cursor, self.target("crp_indivs"), INDIVS_COLS, self.batch_size, self.progress, self.quarantine)
+            for i in xrange(0, len(rows), self.batch_size):
+                inserter.addbatch(rows[i:i + self.batch_size])
+            inserter.flush()
+            return inserter.count
+        with fifo(lambda outfile: StagingFile(outfile).addbatch(rows)) as staged:
+            loaded = loadstaged(self.cursor, staged, self.target("crp_indivs"), INDIVS_COLS, quarantine=self.quarantine)
+        self.progress.add(rows=loaded)
+        return loaded
+
+
+    def resumeindivs(self, year):
+        """Loads indivsYY.txt a chunk at a time, committing each chunk together
+        with a checkpoint of the byte offset it ends at and the rows loaded so
+        far. If an earlier load of the same file stopped partway, it carries on
+        from its last checkpoint instead of emptying the cycle and starting over."""
+        name = self.sourcefile('indivs', year)
+        fingerprint = self.source.fingerprint(name)
+        last = not self.force and self.lastcheckpoint('indivs', year)
+        if last and last[0] == fingerprint:
+            fingerprint, start, count = last
+            logging.info("Resuming %s at byte %i, %i rows already loaded" % (name, start, count))
+        else:
+            start, count = 0, 0
+            #committed with the first chunk: until the load is done the cycle isn't up to date
+            self.cursor.execute("DELETE FROM crp_loads WHERE tablename=%s AND cycle=%s", ('indivs', year))
+            self.replace(["crp_indivs"], [year], lambda year: None)
+
+        donors = self.donorindex()
+        if donors and start:
+            #the index covers the whole file, so the rows already loaded are read for it
+            #again; their rejects were set aside by the run that loaded them
+            for offset, rows in readchunks(self.source.open(name, 'rb'), 0, start, self.checkpoint_size):
+                rows, rejected = bywidth(rows, INDIVS_WIDTH)
+                donors.add([donorkeys(splitindivs(row)) for row in rows])
+        encoder = self.encoder('indivs', INDIVS_COLS)
+        try:
+            for offset, rows in readchunks(self.source.open(name, 'rb'), start, None, self.checkpoint_size):
+                rows = splitbatch(rows, self.quarantine)
+                if donors:
+                    donors.add([donorkeys(row) for row in rows])
+                if encoder:
+                    encoder.encode(rows)
+                count += self.loadchunk(rows)
+                self.checkpoint('indivs', year, fingerprint, offset, count)
+        finally:
+            if encoder:
+                encoder.close()
+        logging.info("Loaded %i rows from %s" % (count, name))
+        self.cursor.execute("DELETE FROM crp_checkpoints WHERE tablename=%s AND cycle=%s", ('indivs', year))
+        self.savedonors(donors, year)
+
+
+    def setup(self):
+        Loader.setup(self)
+        if self.delta:
+            for table, (key_field, column) in sorted(DELTA_KEYS.items()):
+                if key_field is not None:
+                    continue
+                self.cursor.execute("SHOW COLUMNS FROM crp_%s LIKE 'RowKey'" % table)
+                if not self.cursor.fetchone():
+                    self.cursor.execute("ALTER TABLE crp_%s ADD COLUMN RowKey char(16) NULL, ADD INDEX rowkey (RowKey)" % table)
+
+
+    def applydelta(self, table, year):
+        """Deletes and inserts just the rows of table's cycle that differ from the
+        last delta load, recording them in the change feed. Without a usable
+        record of that load, the whole cycle is replaced."""
+        name = self.sourcefile(table, year)
+        target = self.target("crp_" + table)
+        cycle = "20" + year
+        key_field, key_column = DELTA_KEYS[table]
+        cols, clause = deltacolumns(table)
+        width = table == 'indivs' and INDIVS_WIDTH or len(cols) - 1
+
+        new = []
+        donors = table == 'indivs' and self.donorindex()
+        for rows in readbatches(self.source.open(name, 'rb')):
+            rows, rejected = bywidth(rows, width)
+            for row in rejected:
+                self.quarantine.reject(row, 'width')
+            keyed = []
             for row in rows:
-                if len(row)>0:
-                    cols = ''
-                    if table=='indivs':
-                        #split contrib and fam?
-                        cols = '(Cycle,FECTransID,ContribID,Contrib,RecipID,Orgname,UltOrg,RealCode,Date,Amount,street,City,State,Zip,Recipcode,Type,CmteID,OtherID,Gender,FECOccEmp,Microfilm ,Occ_EF,Emp_EF,Src,lastname,first,first3,fam)'
-                        lastname = row[3].split(', ')[0]
-                        first = row[3][len(lastname)+2:]
-                        row.append(lastname)
-                        row.append(first)
-                        row.append(first[:3])
-                        row.append(row[2][11:]) #family member identifier
-                        row[2] = row[2][:11]   #family identifier
-                        row[8] = reformatdate(row[8])
-
-
-                    sql = "INSERT INTO crp_%s %s VALUES (" % (table, cols)
-                    for f in row:
-                        f = f.decode('iso8859-1').encode('utf-8','ignore').strip()
-                        sql = sql+' %s,'
-                    sql = sql[:-1]+");"
-
-                    try:
-                        self.cursor.execute(sql,tuple(row)) 
-                    except:
-                        print( "This FAILED:" + sql + str(row) )
-                        pass
-
-
-        ext = ".txt"
-        for year in self.cycles:
-            """self.cursor.execute("DELETE FROM crp_cmtes WHERE cycle='20%s'" % year)
-            self.cursor.execute("LOAD DATA LOCAL INFILE '%s' INTO TABLE crp_cmtes FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '|'" % os.path.join(self.dest_path, "cmtes" + year + ext))
-            
-            self.cursor.execute("DELETE FROM crp_cands WHERE cycle='20%s'" % year)
-            self.cursor.execute("LOAD DATA LOCAL INFILE '%s' INTO TABLE crp_cands FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '|'" % os.path.join(self.dest_path, "cands" + year + ext))
-            
-            self.cursor.execute("DELETE FROM crp_indivs WHERE cycle='20%s'" % year)
-            writerowsfromcsv( os.path.join(self.dest_path, "indivs" + year + ext), "indivs")"""
-            
-            self.cursor.execute("DELETE FROM crp_pacs WHERE cycle='20%s'" % year)
-            sql = "LOAD DATA LOCAL INFILE '" + os.path.join(self.dest_path, "pacs" + year + ext) + "' INTO TABLE crp_pacs  FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '|' (Cycle,FECRecNo,PACID,CID,Amount,@Date_orig,RealCode,Type,DI,FECCandID) SET Date = STR_TO_DATE(@Date_orig, '%m/%d/%Y')"
-            self.cursor.execute(sql)
-            
-            self.cursor.execute("DELETE FROM crp_pac_other WHERE cycle='20%s'" % year)
-            self.cursor.execute("LOAD DATA LOCAL INFILE '"+os.path.join(self.dest_path, "pac_other" + year + ext)+"' INTO TABLE crp_pac_other FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '|' (Cycle,FECRecNo,FilerID,DonorCmte,ContribLendTrans,City,State,Zip,FECOccEmp,PrimCode,@Date_orig,Amount,RecipID,Party,OtherID,RecipCode,RecipPrimcode,Amend,Report,PG,Microfilm,Type,Realcode,Source) SET Date = STR_TO_DATE(@Date_orig, '%m/%d/%Y')")
-
-
-    def go(self):
-        self.createtables()
-        self.populatetables()
+                #a key too long for an entry couldn't be told apart from others sharing its start
+                if keyfits(row, key_field):
+                    keyed.append(row)
+                else:
+                    self.quarantine.reject(row, 'key')
+            rows = keyed
+            new.extend([entry(row, key_field) for row in rows])
+            if donors:
+                #the index covers every row, not just the changed ones
+                donors.add([donorkeys(splitindivs(list(row))) for row in rows])
+        new.sort()
+
+        state = DeltaState(os.path.join(self.delta_path, 'state', table + year))
+        fingerprint = self.source.fingerprint(name)
+        last, old = state.load()
+        feed = ChangeFeed(os.path.join(self.delta_path, 'feed'), table + year)
+        encoder = self.encoder(table, cols)
+        try:
+            if self.force or not last or last != self.lastload(table, year):
+                logging.info("No delta state for %s%s to go by, replacing the cycle" % (table, year))
+                self.cursor.execute("DELETE FROM %s WHERE Cycle=%%s" % target, (cycle,))
+                feed.write('T', cycle)
+                old = ''
+            deleted, inserted = diff(old, new)
+
+            updated = set()
+            if key_field is not None:
+                updated = set([e[:KEY_SIZE] for e in deleted]) & set([e[:KEY_SIZE] for e in inserted])
+            #one row per entry, so repeated rows go one at a time
+            sql = "DELETE FROM %s WHERE Cycle=%%s AND %s=%%s LIMIT 1" % (target, key_column)
+            for e in deleted:
+                key = printablekey(e[:KEY_SIZE], key_field)
+                self.cursor.execute(sql, (cycle, key))
+                if e[:KEY_SIZE] not in updated:
+                    feed.write('D', key)
+
+            wanted = {}
+            for e in inserted:
+                wanted[e] = wanted.get(e, 0) + 1
+            def stage(outfile):
+                staged = StagingFile(outfile)
+                for rows in readbatches(self.source.open(name, 'rb')):
+                    changed = []
+                    for row in rows:
+                        if len(row) != width or not keyfits(row, key_field):
+                            continue
+                        e = entry(row, key_field)
+                        if not wanted.get(e):
+                            continue
+                        wanted[e] -= 1
+                        if key_field is None:
+                            row = row + [e[:KEY_SIZE].encode('hex')]
+                        else:
+                            row = splitindivs(row)
+                        feed.write(e[:KEY_SIZE] in updated and 'U' or 'I', printablekey(e[:KEY_SIZE], key_field), row)
+                        changed.append(row)
+                    if encoder:
+                        encoder.encode(changed)
+                    staged.addbatch(changed)
+            if inserted:
+                with fifo(stage) as staged:
+                    self.progress.add(rows=loadstaged(self.cursor, staged, target, cols, clause, self.quarantine))
+        except:
+            feed.discard()
+            raise
+        finally:
+            if encoder:
+                encoder.close()
+        feed.close()
+        state.save(fingerprint, new)
+        self.savedonors(donors, year)
+
+
+    def loadtable(self, table, years):
+        if self.delta and table in DELTA_KEYS:
+            #changes are applied in place, a cycle at a time
+            for year in years:
+                self.applydelta(table, year)
+        elif self.resume and table == 'indivs' and not self.swap:
+            #a shadow table is rebuilt from scratch each time, so there's nothing to resume
+            for year in years:
+                self.resumeindivs(year)
+        else:
+            Loader.loadtable(self, table, years)
+
+
+    def sourcefile(self, table, year):
+        return table + year + ".txt"
 
 
+    def fill(self, table, year):
+        name = self.sourcefile(table, year)
+        logging.info("Loading " + name)
+        if table=='indivs':
+            self.loadindivs(name, year)
+        elif self.compact and table in ['pacs', 'pac_other']:
+            cols, clause = columnlist(LOAD_COLUMNS[table])
+            self.loadencoded(name, table, cols, clause)
+        else:
+            with self.source.localpath(name) as src:
+                self.progress.add(rows=loadcrp(self.cursor, src, self.target("crp_" + table), LOAD_COLUMNS[table], self.quarantine))
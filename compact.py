@@ -0,0 +1,193 @@
+"""
+A compact form of the big tables, in which the short code columns (industry,
+recipient, transaction type, state, party and source codes) hold a smallint id
+in place of the code. Each kind of code has a dimension table, crp_dim_X, of
+(id, code) that only ever grows, so ids stay the same across reloads of the
+lookup tables; crp_dim_catcode.code joins crp_categories.catcode and
+crp_dim_expcode.code joins crp_expendcodes.expcode. A crp_X_codes view of
+each table shows the codes again.
+
+The loaders encode rows as they stage them. Codes not seen before are added
+to their dimension on a connection of the encoder's own, committed at once,
+so load jobs running side by side never wait on each other's new codes.
+
+Cycle isn't encoded: it's what the loads delete, partition and summarize by.
+
+Once a table is in compact form, every load of it has to encode, or codes
+would be cast into the id columns; so a loader run without compact mode on
+tables that already hold ids turns it on (see Loader.setup).
+"""
+
+import logging
+
+from crpformat import readbatches
+from loader import StagingFile, connect, tablecolumns
+from quarantine import bywidth
+
+
+COMPACT_COLUMNS = {
+    'indivs': ['RealCode', 'Recipcode', 'Type', 'State', 'Src'],
+    'pacs': ['RealCode', 'Type'],
+    'pac_other': ['PrimCode', 'RecipCode', 'RecipPrimcode', 'Party', 'Type', 'Realcode', 'State'],
+    'expends': ['recipcode', 'ExpCode', 'Type', 'State'],
+    'lobbying': ['catcode'],
+}
+
+#the dimension each column's codes go in; the industry codes share one
+DIMENSIONS = {
+    'realcode': 'catcode',
+    'primcode': 'catcode',
+    'recipprimcode': 'catcode',
+    'catcode': 'catcode',
+    'recipcode': 'recipcode',
+    'type': 'type',
+    'state': 'state',
+    'party': 'party',
+    'src': 'src',
+    'expcode': 'expcode',
+}
+
+#codes that differ only in case are different codes, so code is compared byte for byte
+DIMENSION_TABLE = """CREATE TABLE IF NOT EXISTS crp_dim_%s(
+                id smallint unsigned NOT NULL AUTO_INCREMENT,
+                code varbinary(10) NOT NULL,
+                PRIMARY KEY (id),
+                UNIQUE KEY (code)
+                );"""
+
+
+def fields(table, cols):
+    #(position in cols, dimension) of each of table's code columns
+    compact = [col.lower() for col in COMPACT_COLUMNS.get(table, [])]
+    return [(i, DIMENSIONS[col.strip().lower()]) for i, col in enumerate(cols) if col.strip().lower() in compact]
+
+
+def encodeknown(rows, fields, codes):
+    """Replaces the codes in rows with their ids from codes. Returns the rows
+    done and, untouched, the rows with a code that isn't in codes."""
+    done = []
+    pending = []
+    for row in rows:
+        try:
+            ids = [codes[dimension][row[i]] for i, dimension in fields]
+        except KeyError:
+            pending.append(row)
+            continue
+        for (i, dimension), id in zip(fields, ids):
+            row[i] = id
+        done.append(row)
+    return done, pending
+
+
+class Encoder(object):
+
+    def __init__(self,cursor,table,cols):
+
+        self.fields = fields(table, cols)
+        self.db = None
+        #{dimension: {code: id}}, ids as strings ready for staging
+        self.codes = {}
+        for i, dimension in self.fields:
+            if dimension not in self.codes:
+                cursor.execute("SELECT code, id FROM crp_dim_" + dimension)
+                self.codes[dimension] = dict([(code, str(id)) for code, id in cursor.fetchall()])
+
+
+    def add(self, dimension, code):
+        if self.db is None:
+            self.db = connect()
+            self.db.autocommit(True)
+        cursor = self.db.cursor()
+        cursor.execute("INSERT IGNORE INTO crp_dim_%s (code) VALUES (%%s)" % dimension, (code,))
+        cursor.execute("SELECT id FROM crp_dim_%s WHERE code=%%s" % dimension, (code,))
+        self.codes[dimension][code] = str(cursor.fetchone()[0])
+
+
+    def encode(self, rows):
+        """Encodes rows in place, adding any new codes first."""
+        done, pending = encodeknown(rows, self.fields, self.codes)
+        for row in pending:
+            for i, dimension in self.fields:
+                if row[i] not in self.codes[dimension]:
+                    self.add(dimension, row[i])
+        encodeknown(pending, self.fields, self.codes)
+        return rows
+
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+def dimensiontable(cursor, dimension):
+    #creates crp_dim_<dimension>, or gives one made before codes were binary its binary code column
+    cursor.execute(DIMENSION_TABLE % dimension)
+    cursor.execute("SHOW COLUMNS FROM crp_dim_%s LIKE 'code'" % dimension)
+    if 'binary' not in cursor.fetchone()[1].lower():
+        cursor.execute("ALTER TABLE crp_dim_%s MODIFY code varbinary(10) NOT NULL" % dimension)
+
+
+def compacted(cursor, tables):
+    """The tables, of those given, whose code columns already hold ids."""
+    found = []
+    for table in tables:
+        for col in COMPACT_COLUMNS.get(table, []):
+            cursor.execute("SHOW COLUMNS FROM crp_%s LIKE %%s" % table, (col,))
+            row = cursor.fetchone()
+            if row and 'char' not in row[1].lower():
+                found.append(table)
+                break
+    return found
+
+
+def compacttable(cursor, table):
+    """Converts crp_<table>'s code columns to ids if they still hold codes, and
+    creates its crp_<table>_codes view."""
+    name = "crp_" + table
+    converting = []
+    for col in COMPACT_COLUMNS[table]:
+        dimension = DIMENSIONS[col.lower()]
+        dimensiontable(cursor, dimension)
+        cursor.execute("SHOW COLUMNS FROM %s LIKE %%s" % name, (col,))
+        if 'char' not in cursor.fetchone()[1].lower():
+            continue
+        #BINARY, or the column's collation would fold codes that differ in case into one
+        cursor.execute("INSERT IGNORE INTO crp_dim_%s (code) SELECT DISTINCT BINARY %s FROM %s WHERE %s IS NOT NULL" % (dimension, col, name, col))
+        cursor.execute("UPDATE %s t JOIN crp_dim_%s d ON d.code = t.%s SET t.%s = d.id" % (name, dimension, col, col))
+        converting.append(col)
+    if converting:
+        logging.info("Converting %s to ids in %s" % (', '.join(converting), name))
+        cursor.execute("ALTER TABLE %s %s" % (name, ', '.join(["MODIFY %s smallint unsigned NULL" % col for col in converting])))
+
+    columns = tablecolumns(cursor, name)
+    compact = dict([(col.lower(), col) for col in COMPACT_COLUMNS[table]])
+    select = []
+    joins = []
+    for col in columns:
+        if col.lower() in compact:
+            alias = "d_" + col.lower()
+            select.append("%s.code AS %s" % (alias, col))
+            joins.append("LEFT JOIN crp_dim_%s %s ON %s.id = t.%s" % (DIMENSIONS[col.lower()], alias, alias, col))
+        else:
+            select.append("t." + col)
+    cursor.execute("CREATE OR REPLACE VIEW %s_codes AS SELECT %s FROM %s t %s" % (name, ', '.join(select), name, ' '.join(joins)))
+
+
+def stageencoded(infile, outfile, encoder, width, quarantine):
+    """Stages a CRP file for LOAD DATA with its code columns encoded. infile
+    is anything crpformat.readbatches reads from."""
+    staged = StagingFile(outfile)
+    for rows in readbatches(infile):
+        rows, rejected = bywidth(rows, width)
+        for row in rejected:
+            quarantine.reject(row, 'width')
+        staged.addbatch(encoder.encode(rows))
+    staged.close()
+    return staged.count
+
+
+def compacttables(cursor, tables):
+    for table in tables:
+        if table in COMPACT_COLUMNS:
+            compacttable(cursor, table)
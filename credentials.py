@@ -9,3 +9,16 @@ MYSQL_DB = "crp" #create this database manually before running
 
 SRC_PATH = 'download'
 DEST_PATH = 'raw'
+UNZIP = False #extract zips into DEST_PATH; otherwise members are streamed straight from SRC_PATH
+
+DOWNLOAD_WORKERS = 4 #files fetched at once
+DOWNLOAD_RATE = 0 #combined bytes/sec cap for downloads, 0 for none
+
+CAMPFIN_TABLES = ['pacs', 'pac_other'] #campaign finance tables loaded; add 'indivs' (several GB a cycle), 'cmtes' or 'cands'
+BATCH_SIZE = 5000 #rows per multi-row INSERT
+WORKERS = 1 #parallel load jobs, each on its own MySQL connection
+PARSE_WORKERS = 1 #processes parsing each indivs file
+INDEX_PROFILE = 'minimal' #indexes added after loading: minimal, analytics or full
+MAX_REJECTS = 1000 #rows a load job may set aside in rejects/ before it is stopped, 0 for no limit
+
+OPENSECRETS_URL = "http://www.opensecrets.org" #site scraped for lead PACs; point at a local server to test
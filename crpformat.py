@@ -0,0 +1,213 @@
+"""
+A reader for CRP's bulk file format: comma-separated, text fields quoted
+with pipes, iso8859-1 encoded, CRLF line endings.
+
+Rather than decoding and splitting line by line through the csv module, the
+file is read in large blocks, each block is transcoded to utf-8 in one call,
+and lines are split on the pipes with str.split, which does the scanning in C.
+Rows come out in batches, already clean, ready for BatchInserter.addbatch or
+StagingFile.addbatch.
+
+A file on disk can also be cut into chunks on record boundaries with
+chunkbounds, so separate processes can each readchunk a piece of it. Any
+file, zip members included, can be read a chunk at a time with splitchunks,
+for parsechunk elsewhere, or readchunks, which gives the byte offset each
+chunk ends at so a load can pick up from there later.
+"""
+
+import mmap
+import os
+
+from loader import BATCH_SIZE
+
+
+BLOCK_SIZE = 4 * 1024 * 1024
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def splitline(line):
+    """Fields of one line. Split on pipes, the odd pieces are the quoted fields
+    and the even ones the commas between them, with any unquoted fields."""
+    parts = line.split('|')
+    if len(parts) == 1:
+        return [f.strip() for f in line.split(',')]
+    row = []
+    last = len(parts) - 1
+    for i, part in enumerate(parts):
+        if i % 2:
+            row.append(part.strip())
+            continue
+        bare = part.split(',')
+        #drop the empty ends next to the quoted fields on either side
+        bare = bare[i > 0:len(bare) - (i < last)]
+        if bare:
+            row.extend([f.strip() for f in bare])
+    return row
+
+
+def readlines(infile, block_size=BLOCK_SIZE):
+    #complete lines, transcoded to utf-8 a block at a time; infile can also be
+    #any iterable of the raw text, such as some of a file's records
+    blocks = infile
+    if hasattr(infile, 'read'):
+        blocks = iter(lambda: infile.read(block_size), '')
+    rest = ''
+    for block in blocks:
+        end = block.rfind('\n') + 1
+        if not end:
+            rest += block
+            continue
+        text = (rest + block[:end]).decode('iso8859-1').encode('utf-8')
+        rest = block[end:]
+        for line in text.splitlines():
+            yield line
+    if rest:
+        for line in rest.decode('iso8859-1').encode('utf-8').splitlines():
+            yield line
+    if hasattr(infile, 'close'):
+        infile.close()
+
+
+def parselines(lines):
+    pending = None
+    for line in lines:
+        if pending is not None:
+            line = pending + '\n' + line
+            pending = None
+        if line.count('|') % 2:
+            #a quoted field runs on to the next line
+            pending = line
+            continue
+        if line:
+            yield splitline(line)
+    if pending:
+        yield splitline(pending)
+
+
+def readbatches(infile, batch_size=BATCH_SIZE, block_size=BLOCK_SIZE):
+    """Yields lists of up to batch_size rows, each a list of utf-8 fields, from
+    an open file or an iterable of raw text as readlines takes."""
+    batch = []
+    for row in parselines(readlines(infile, block_size)):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def countpipes(mm, start, end):
+    count = 0
+    for offset in xrange(start, end, BLOCK_SIZE):
+        count += mm[offset:min(offset + BLOCK_SIZE, end)].count('|')
+    return count
+
+
+def chunkbounds(path, parts):
+    """Offsets that cut path into about parts pieces, each starting a record: just
+    after a newline with an even number of pipes, so outside any quoted field,
+    since the last cut."""
+    infile = open(path, 'rb')
+    size = os.fstat(infile.fileno()).st_size
+    bounds = [0]
+    if size:
+        mm = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for i in range(1, parts):
+                start = bounds[-1]
+                pos = mm.find('\n', max(size * i / parts, start))
+                if pos == -1:
+                    break
+                pipes = countpipes(mm, start, pos)
+                while pipes % 2:
+                    following = mm.find('\n', pos + 1)
+                    if following == -1:
+                        break
+                    pipes += countpipes(mm, pos, following)
+                    pos = following
+                if pipes % 2 or pos + 1 >= size:
+                    break
+                bounds.append(pos + 1)
+        finally:
+            mm.close()
+    infile.close()
+    bounds.append(size)
+    return bounds
+
+
+def recordend(text):
+    #the end of the last whole record in text: just past a newline with an even
+    #number of pipes before it, or 0 if there isn't one
+    pipes = text.count('|')
+    pos = len(text)
+    while True:
+        newline = text.rfind('\n', 0, pos)
+        if newline == -1:
+            return 0
+        pipes -= text.count('|', newline + 1, pos)
+        if pipes % 2 == 0:
+            return newline + 1
+        pos = newline
+
+
+def parsechunk(text):
+    #the rows of a run of whole records, still iso8859-1
+    return list(parselines(text.decode('iso8859-1').encode('utf-8').splitlines()))
+
+
+def splitchunks(infile, start=0, end=None, chunk_size=CHUNK_SIZE):
+    """Yields (offset, text) for each chunk of about chunk_size bytes of infile
+    between bytes start and end, text being the raw records and offset where
+    they end. start and end must fall between records, as the offsets yielded
+    do. infile should be opened in binary mode, so the offsets are true byte
+    offsets."""
+    position = 0
+    if start:
+        try:
+            infile.seek(start)
+            position = start
+        except (AttributeError, IOError, ValueError):
+            #zip members can't seek, so they are read up to the start
+            pass
+    while position < start:
+        skipped = infile.read(min(start - position, BLOCK_SIZE))
+        if not skipped:
+            break
+        position += len(skipped)
+    offset = position
+    rest = ''
+    while end is None or position < end:
+        block = infile.read(end is None and chunk_size or min(chunk_size, end - position))
+        if not block:
+            break
+        position += len(block)
+        text = rest + block
+        cut = recordend(text)
+        rest = text[cut:]
+        if cut:
+            offset += cut
+            yield offset, text[:cut]
+    if rest:
+        offset += len(rest)
+        yield offset, rest
+    infile.close()
+
+
+def readchunks(infile, start=0, end=None, chunk_size=CHUNK_SIZE):
+    """splitchunks, with each chunk's text parsed into rows, so a load can
+    pick up later from any offset yielded."""
+    for offset, text in splitchunks(infile, start, end, chunk_size):
+        yield offset, parsechunk(text)
+
+
+def readchunk(path, start, end):
+    """The rows between two of chunkbounds' offsets."""
+    infile = open(path, 'rb')
+    mm = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        text = mm[start:end]
+    finally:
+        mm.close()
+        infile.close()
+    return parsechunk(text)
@@ -0,0 +1,142 @@
+"""
+Row-level deltas between two releases of a CRP file.
+
+Each row of a load is reduced to a 16-byte entry: an 8-byte key and 8 bytes
+of the md5 of the row. For a table with a natural key (FECTransID within a
+cycle of crp_indivs) the key is that value, which has to fit in 8 bytes, so
+rows can be deleted by it; for the tables without one it is
+the row's own hash, kept in a RowKey column, so a changed row shows up as a
+delete and an insert. The sorted entries of the last load are kept on disk,
+and a merge against the new ones gives the rows to delete and to insert.
+
+What was applied is also written to a gzipped change feed, one line per
+change: the operation (T truncated the cycle, I inserted, U updated,
+D deleted), the key, then for I and U the row's fields as loaded, all
+tab-separated and escaped like LOAD DATA's input.
+"""
+
+import gzip
+import hashlib
+import logging
+import os
+import time
+
+from loader import escapefield
+
+
+DELTA_PATH = 'delta'
+KEY_SIZE = 8
+RECORD = 16
+
+
+def rowhash(row):
+    return hashlib.md5('\t'.join(row)).digest()[:8]
+
+
+def keyfits(row, key_field=None):
+    #whether row's key can be kept whole in an entry
+    return key_field is None or len(row[key_field]) <= KEY_SIZE
+
+
+def entry(row, key_field=None):
+    """The entry for a row: keyed on row[key_field], or with no key field on the
+    row's hash, which is then its key as well. A key longer than KEY_SIZE is a
+    ValueError rather than cut short, where it could match another row's."""
+    digest = rowhash(row)
+    if key_field is None:
+        return digest + digest
+    if not keyfits(row, key_field):
+        raise ValueError("key %r is longer than %i bytes" % (row[key_field], KEY_SIZE))
+    return row[key_field].ljust(KEY_SIZE) + digest
+
+
+def printablekey(key, key_field=None):
+    if key_field is None:
+        return key.encode('hex')
+    return key.rstrip()
+
+
+def diff(old, new):
+    """Entries only in old and only in new. old is a string of sorted entries as
+    saved, new a sorted list of them; repeats are matched one for one."""
+    deleted = []
+    inserted = []
+    count = len(old) / RECORD
+    i = j = 0
+    while i < count and j < len(new):
+        previous = old[i * RECORD:(i + 1) * RECORD]
+        if previous == new[j]:
+            i += 1
+            j += 1
+        elif previous < new[j]:
+            deleted.append(previous)
+            i += 1
+        else:
+            inserted.append(new[j])
+            j += 1
+    deleted.extend([old[k * RECORD:(k + 1) * RECORD] for k in xrange(i, count)])
+    inserted.extend(new[j:])
+    return deleted, inserted
+
+
+class DeltaState(object):
+    """The sorted entries of a table's last delta load for one cycle, with the
+    fingerprint of the file they came from."""
+
+    def __init__(self,path):
+
+        self.path = path
+
+
+    def load(self):
+        #(fingerprint, entries), or (None, '') if there's no earlier load
+        if not os.path.exists(self.path):
+            return None, ''
+        infile = open(self.path, 'rb')
+        try:
+            fingerprint = infile.readline().rstrip('\n')
+            return fingerprint, infile.read()
+        finally:
+            infile.close()
+
+
+    def save(self, fingerprint, entries):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_path = "%s.%i.tmp" % (self.path, os.getpid())
+        outfile = open(tmp_path, 'wb')
+        outfile.write((fingerprint or '') + '\n')
+        outfile.write(''.join(entries))
+        outfile.close()
+        os.rename(tmp_path, self.path)
+
+
+class ChangeFeed(object):
+
+    def __init__(self,path,name):
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.path = os.path.join(path, "%s-%s.changes.gz" % (name, time.strftime('%Y%m%d%H%M%S')))
+        self.outfile = gzip.open(self.path, 'wb')
+        self.counts = {}
+
+
+    def write(self, op, key, row=None):
+        fields = [op, key]
+        if row is not None:
+            fields.extend(row)
+        self.outfile.write('\t'.join([escapefield(f) for f in fields]) + '\n')
+        self.counts[op] = self.counts.get(op, 0) + 1
+
+
+    def discard(self):
+        #the changes weren't applied after all
+        self.outfile.close()
+        os.remove(self.path)
+
+
+    def close(self):
+        self.outfile.close()
+        logging.info("Changes: %s, see %s" % (', '.join(["%s %i" % item for item in sorted(self.counts.items())]) or 'none', self.path))
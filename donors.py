@@ -0,0 +1,172 @@
+"""
+An on-disk index of the donors in crp_indivs, for finding the contributions
+that probably come from the same person without joining crp_indivs to itself.
+
+Each row is blocked on two keys: its lastname, first3 and zip, and the family
+part of its ContribID. The keys are hashed to 64 bits and kept, one cycle per
+file, as flat arrays: the FECTransIDs in order, whole and padded to the
+longest of them, each row's two key hashes, and for each key the rows sorted
+by it, so a lookup is a binary search.
+
+    index = DonorIndex('donors/indivs12.donors')
+    index.byname('SMITH', 'JOHN', '22201')
+    index.byfamily('h0000010464')
+    index.cluster('0000003')
+
+Each returns FECTransIDs. They're candidates: rows sharing a block, with the
+odd unrelated row from a hash collision, to be checked before merging.
+"""
+
+import json
+import os
+import zlib
+from array import array
+
+
+DONOR_PATH = 'donors'
+
+#8-byte hashes; array's 'L' is 8 bytes on 64-bit Unix
+HASH_TYPE = 'L'
+
+
+def keyhash(key):
+    #0 is kept for rows without the key
+    if not key:
+        return 0
+    return ((zlib.crc32(key) & 0xffffffff) << 32 | (zlib.adler32(key) & 0xffffffff)) or 1
+
+
+def namekey(lastname, first, zipcode):
+    lastname = lastname.strip().upper()
+    if not lastname:
+        return ''
+    return "%s|%s|%s" % (lastname, first.strip().upper()[:3], zipcode.strip()[:5])
+
+
+def donorkeys(row):
+    """(FECTransID, name hash, family hash) for a crp_indivs row, as split by
+    campfin.splitindivs."""
+    return row[1], keyhash(namekey(row[24], row[26], row[13])), keyhash(row[2].strip())
+
+
+class DonorIndexBuilder(object):
+
+    def __init__(self):
+
+        self.transids = []
+        self.names = array(HASH_TYPE)
+        self.families = array(HASH_TYPE)
+
+
+    def add(self, keys):
+        for transid, name, family in keys:
+            self.transids.append(transid)
+            self.names.append(name)
+            self.families.append(family)
+
+
+    def save(self, path):
+        order = sorted(xrange(len(self.transids)), key=self.transids.__getitem__)
+        names = array(HASH_TYPE, [self.names[i] for i in order])
+        families = array(HASH_TYPE, [self.families[i] for i in order])
+        by_name = array('I', sorted(xrange(len(order)), key=names.__getitem__))
+        by_family = array('I', sorted(xrange(len(order)), key=families.__getitem__))
+        key_size = max([len(transid) for transid in self.transids] or [1])
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_path = "%s.%i.tmp" % (path, os.getpid())
+        outfile = open(tmp_path, 'wb')
+        outfile.write(json.dumps({'rows': len(order), 'hash_size': names.itemsize, 'key_size': key_size}) + '\n')
+        outfile.write(''.join([self.transids[i].ljust(key_size) for i in order]))
+        for a in [names, families, by_name, by_family]:
+            a.tofile(outfile)
+        outfile.close()
+        os.rename(tmp_path, path)
+
+
+class DonorIndex(object):
+
+    def __init__(self,path):
+
+        infile = open(path, 'rb')
+        try:
+            header = json.loads(infile.readline())
+            if header['hash_size'] != array(HASH_TYPE).itemsize:
+                raise ValueError("%s was written with %i-byte hashes" % (path, header['hash_size']))
+            count = header['rows']
+            #files from before FECTransIDs were kept whole have 8 bytes of each
+            self.key_size = header.get('key_size', 8)
+            self.transids = infile.read(self.key_size * count)
+            self.names = array(HASH_TYPE)
+            self.families = array(HASH_TYPE)
+            self.by_name = array('I')
+            self.by_family = array('I')
+            for a in [self.names, self.families, self.by_name, self.by_family]:
+                a.fromfile(infile, count)
+        finally:
+            infile.close()
+        self.count = count
+
+
+    def key(self, i):
+        return self.transids[self.key_size * i:self.key_size * (i + 1)]
+
+
+    def transid(self, i):
+        return self.key(i).rstrip()
+
+
+    def row(self, transid):
+        #the row number of transid, or None
+        if len(transid) > self.key_size:
+            return None
+        transid = transid.ljust(self.key_size)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < transid:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self.key(lo) == transid:
+            return lo
+        return None
+
+
+    def block(self, hashes, order, value):
+        #the rows whose hash is value: order lists the rows sorted by hash
+        if not value:
+            return []
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if hashes[order[mid]] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        rows = []
+        while lo < self.count and hashes[order[lo]] == value:
+            rows.append(order[lo])
+            lo += 1
+        return rows
+
+
+    def byname(self, lastname, first, zipcode):
+        return [self.transid(i) for i in self.block(self.names, self.by_name, keyhash(namekey(lastname, first, zipcode)))]
+
+
+    def byfamily(self, contribid):
+        return [self.transid(i) for i in self.block(self.families, self.by_family, keyhash(contribid.strip()[:11]))]
+
+
+    def cluster(self, transid):
+        """The rows sharing either block with transid's row, itself included."""
+        i = self.row(transid)
+        if i is None:
+            return []
+        rows = set([i])
+        rows.update(self.block(self.names, self.by_name, self.names[i]))
+        rows.update(self.block(self.families, self.by_family, self.families[i]))
+        return [self.transid(j) for j in sorted(rows)]
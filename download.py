@@ -1,12 +1,21 @@
+import base64
 import cookielib
 import csv
 import datetime
+import glob
+import hashlib
+import httplib
 import logging
 import os
 import re
+import socket
 import sys
+import threading
+import time
 import urllib, urllib2
+import zipfile
 import MySQLdb
+from multiprocessing.pool import ThreadPool
 from optparse import make_option
 
 from credentials import *
@@ -15,6 +24,12 @@ from campfin import CampFinDownloader
 from expends import ExpendsDownloader
 from lobby import LobbyDownloader
 from extras import ExtrasDownloader
+from loader import connect
+from manifest import Manifest
+from metrics import metrics, sink
+from export import ParquetExporter
+from pipeline import Pipeline
+from scheduler import LoadScheduler
 
 
 POSSIBLE_SECTIONS = ['campfin','expend','lobby','extras']
@@ -30,11 +45,79 @@ REQUEST_HEADERS = {
 }
 
 
-META_FIELDS = ['filename','ext','description','filesize','updated','url']
+CHUNK_SIZE = 1024 * 1024
+content_range_re = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+filesize_re = re.compile(r"(\d+)MB")
+
+
+class KeepAliveHandler(urllib2.HTTPHandler):
+    """urllib2 opens a new connection for every request. This keeps one
+    connection per host for each thread and reuses it while the server allows."""
+    
+    def __init__(self):
+        urllib2.HTTPHandler.__init__(self)
+        self.local = threading.local()
+    
+    def http_open(self, req):
+        host = req.get_host()
+        if not hasattr(self.local, 'conns'):
+            self.local.conns = {}
+        headers = dict(req.unredirected_hdrs)
+        headers.update(req.headers)
+        headers['Connection'] = 'keep-alive'
+        
+        conn = self.local.conns.get(host)
+        try:
+            if conn is None:
+                raise httplib.NotConnected()
+            conn.request(req.get_method(), req.get_selector(), req.data, headers)
+            resp = conn.getresponse()
+        except (httplib.HTTPException, socket.error):
+            #never connected, or the server dropped the idle connection
+            if conn is not None:
+                conn.close()
+            conn = httplib.HTTPConnection(host, timeout=req.timeout)
+            conn.request(req.get_method(), req.get_selector(), req.data, headers)
+            resp = conn.getresponse()
+        self.local.conns[host] = conn
+        
+        resp.recv = resp.read
+        r = urllib.addinfourl(socket._fileobject(resp, close=True), resp.msg, req.get_full_url())
+        r.code = resp.status
+        r.msg = resp.reason
+        return r
+
+
+class RateLimiter(object):
+    """Caps the combined throughput of all download threads at rate bytes/sec."""
+    
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_free = time.time()
+    
+    def throttle(self, nbytes):
+        if not self.rate:
+            return
+        self.lock.acquire()
+        try:
+            now = time.time()
+            start = max(now, self.next_free)
+            self.next_free = start + float(nbytes) / self.rate
+        finally:
+            self.lock.release()
+        if start > now:
+            time.sleep(start - now)
+
+
+def resource_size(res):
+    m = filesize_re.match(res.get('filesize') or '')
+    return m and int(m.group(1)) or 0
+
 
 class CRPDownloader(object):
     
-    def __init__(self,cycles,sections):
+    def __init__(self,cycles,sections,workers=DOWNLOAD_WORKERS,rate=DOWNLOAD_RATE):
         
         self.email = CRP_EMAIL
         self.password = CRP_PASSWORD
@@ -42,12 +125,15 @@ class CRPDownloader(object):
         self.cycles = cycles
         
         self.sections = sections
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
         
-        # setup opener
+        # setup opener, shared by all download threads along with its cookie jar
         self.opener = urllib2.build_opener(
             urllib2.HTTPCookieProcessor(
                 cookielib.LWPCookieJar()
-            )
+            ),
+            KeepAliveHandler()
         )
         
         if not os.path.exists(self.path):
@@ -55,19 +141,7 @@ class CRPDownloader(object):
         if not os.path.exists(DEST_PATH):
             os.system("mkdir %s" % DEST_PATH)
         
-        self.meta = { }
-        meta_path = os.path.join(self.path, 'meta.csv')
-        print meta_path
-        if os.path.exists(meta_path):
-            print 'exists'
-            meta_file = open(meta_path, 'r').read()
-            reader = csv.DictReader(meta_file, fieldnames=META_FIELDS)
-            print meta_file
-            for record in reader:
-                self.meta[record['url']] = record
-                
-        else:
-            logging.info("no existing meta file at %s" % meta_path)
+        self.manifest = Manifest(os.path.join(self.path, 'manifest.json'))
 
     
     def go(self, sections, redownload=False):
@@ -77,44 +151,149 @@ class CRPDownloader(object):
     
     def _bulk_download(self, resources, sections, redownload=False):
         
-        meta_file = open(os.path.join(self.path, 'meta.csv'), 'w+')
-        meta = csv.DictWriter(meta_file, fieldnames=META_FIELDS)
-        
-        logging.info(self.meta)
+        failed = [res for res in self.downloads(self.pending(resources, sections, redownload)) if res.get('error')]
+        if failed:
+            raise IOError("failed to download %s" % ', '.join(["%s.%s" % (res['filename'], res['ext']) for res in failed]))
+    
+    def pending(self, resources, sections, redownload=False):
         
+        pending = []
         for res in resources:
             
-            if not redownload and res['url'] in self.meta:
-                if res['updated'] == self.meta[res['url']]['updated']:
-                    logging.info('ignoring %s.%s, local file is up to date' % (res['filename'], res['ext']))
-                    meta.writerow(self.meta[res['url']])
-                    continue
-                elif (res['filename']=='Lobby' and 'lobby' not in sections) or \
-                    (res['filename'].startswith('CampaignFin') and 'campfin' not in sections) or \
-                    (res['filename'].startswith('Expend') and 'expend' not in sections):
-                    logging.info('ignoring %s.%s, not specified for download' % (res['filename'], res['ext']))
-                    meta.writerow(self.meta[res['url']])
-                    continue
-            
             file_path = os.path.join(self.path, "%s.%s" % (res['filename'], res['ext']))
+            record = self.manifest.get(res['url'])
             
-            logging.info('downloading %s.%s' % (res['filename'], res['ext']))
+            if (res['filename']=='Lobby' and 'lobby' not in sections) or \
+                (res['filename'].startswith('CampaignFin') and 'campfin' not in sections) or \
+                (res['filename'].startswith('Expend') and 'expend' not in sections):
+                logging.info('ignoring %s.%s, not specified for download' % (res['filename'], res['ext']))
+                continue
+            elif not redownload and record and record['updated'] == res['updated'] and os.path.exists(file_path):
+                logging.info('ignoring %s.%s, local file is up to date' % (res['filename'], res['ext']))
+                continue
             
-            r = self.opener.open(res['url'])
-                            
-            outfile = open(file_path, 'w')
-            outfile.write(r.read())
-            outfile.close()
+            pending.append(res)
+        
+        #start the biggest files first so a large one isn't left running alone at the end
+        pending.sort(key=resource_size, reverse=True)
+        return pending
+    
+    def downloads(self, pending, window=None):
+        """Fetches pending on the thread pool, yielding each resource as soon as it
+        is in place and recorded in the manifest, or with its error if it failed;
+        one failure doesn't stop the rest. With a window, at most that many
+        fetches are outstanding, started but not yet taken by the consumer, so the
+        downloads wait while the consumer does."""
+        
+        slots = threading.Semaphore(window or len(pending) or 1)
+        stopped = []
+        def submit():
+            #runs on the pool's task thread, which hands out work only as slots free up
+            for res in pending:
+                slots.acquire()
+                if stopped:
+                    return
+                yield res
+        
+        pool = ThreadPool(max(self.workers, 1))
+        try:
+            for res in pool.imap_unordered(self._download, submit()):
+                if not res.get('error'):
+                    self.manifest.update(res, os.path.join(self.path, "%s.%s" % (res['filename'], res['ext'])))
+                    self.manifest.save()
+                yield res
+                slots.release()
+        finally:
+            #let a task thread waiting for a slot see that we're done
+            stopped.append(True)
+            slots.release()
+            pool.close()
+            pool.join()
+    
+    def _download(self, res):
+        
+        file_path = os.path.join(self.path, "%s.%s" % (res['filename'], res['ext']))
+        
+        logging.info('downloading %s.%s' % (res['filename'], res['ext']))
+        
+        try:
+            res['md5'] = self.fetch(res['url'], file_path, res['updated'])
             
             res['filesize'] = "%iMB" % (os.path.getsize(file_path) / 1024 / 1024)
             
-            meta.writerow(res)
+            self.extract(file_path, DEST_PATH)
+        except Exception, e:
+            #reported with the resource, so the other downloads carry on
+            logging.exception('failed to download %s.%s' % (res['filename'], res['ext']))
+            res['error'] = e
         
+        return res
         
-            self.extract(file_path, DEST_PATH)
-                    
-        meta_file.close()
+    def fetch(self, url, file_path, updated):
+        """Streams url to disk in CHUNK_SIZE pieces, resuming a partial file left by
+        an interrupted run with a Range request. The file is only moved into place
+        once its size and checksum check out, so extract never sees a truncated zip."""
+        
+        #partial files are tagged with the publication date, so a stale one is never resumed
+        part_path = "%s.%s.part" % (file_path, updated.replace('/', '-'))
+        for stale in glob.glob(file_path + '.*.part'):
+            if stale != part_path:
+                os.remove(stale)
+        
+        offset = 0
+        if os.path.exists(part_path):
+            offset = os.path.getsize(part_path)
+        
+        request = urllib2.Request(url, headers=REQUEST_HEADERS)
+        if offset:
+            request.add_header('Range', 'bytes=%i-' % offset)
+        r = self.opener.open(request)
+        
+        expected = None
+        m = content_range_re.match(r.info().get('Content-Range', ''))
+        if offset and r.getcode() == 206 and m and int(m.group(1)) == offset:
+            logging.info('resuming %s at %i bytes' % (url, offset))
+            expected = int(m.group(3))
+        else:
+            offset = 0
+            if r.info().get('Content-Length'):
+                expected = int(r.info().get('Content-Length'))
+        
+        md5 = hashlib.md5()
+        if offset:
+            infile = open(part_path, 'rb')
+            for chunk in iter(lambda: infile.read(CHUNK_SIZE), ''):
+                md5.update(chunk)
+            infile.close()
+        
+        outfile = open(part_path, offset and 'ab' or 'wb')
+        with metrics.stage('download', os.path.basename(file_path), expected and expected - offset) as downloaded:
+            for chunk in iter(lambda: r.read(CHUNK_SIZE), ''):
+                self.limiter.throttle(len(chunk))
+                outfile.write(chunk)
+                md5.update(chunk)
+                downloaded.add(bytes=len(chunk))
+        outfile.close()
+        r.close()
         
+        size = os.path.getsize(part_path)
+        if expected is not None and size != expected:
+            #leave the partial file in place for the next run to resume
+            raise IOError("%s: got %i of %i bytes" % (url, size, expected))
+        
+        content_md5 = r.info().get('Content-MD5')
+        if content_md5 and base64.b64decode(content_md5) != md5.digest():
+            os.remove(part_path)
+            raise IOError("%s: checksum mismatch" % url)
+        if zipfile.is_zipfile(part_path):
+            bad = zipfile.ZipFile(part_path).testzip()
+            if bad is not None:
+                os.remove(part_path)
+                raise IOError("%s: bad CRC for %s" % (url, bad))
+        
+        os.rename(part_path, file_path)
+        return md5.hexdigest()
+    
     def get_resources(self):
         
         now = datetime.datetime.now()
@@ -122,25 +301,30 @@ class CRPDownloader(object):
         
         resources = []
         
-        # "visit" myos page and authenticate
+        with metrics.stage('scrape', 'bulk') as scraped:
+            
+            # "visit" myos page and authenticate
 
-        r = self.opener.open(LOGIN_URL)
+            r = self.opener.open(LOGIN_URL)
 
-        params = urllib.urlencode({'email': self.email, 'password': self.password, 'Submit': 'Log In'})
-        r = self.opener.open(LOGIN_URL, params)
+            params = urllib.urlencode({'email': self.email, 'password': self.password, 'Submit': 'Log In'})
+            r = self.opener.open(LOGIN_URL, params)
 
-        # get bulk download url
+            # get bulk download url
 
-        r = self.opener.open(BULKDATA_URL)
+            r = self.opener.open(BULKDATA_URL)
+            html = r.read()
+            scraped.add(bytes=len(html))
 
-        DL_RE = re.compile(r'<li>\s*<a href="download.php\?f=(?P<filename>\w+)\.(?P<ext>\w{3})">(?P<description>.+?)</a>\s*(?P<filesize>\d{1,3}MB) -- Last updated: (?P<updated>\d{1,2}/\d{1,2}/\d{2})\s*</li>', re.I | re.M)
+            DL_RE = re.compile(r'<li>\s*<a href="download.php\?f=(?P<filename>\w+)\.(?P<ext>\w{3})">(?P<description>.+?)</a>\s*(?P<filesize>\d{1,3}MB) -- Last updated: (?P<updated>\d{1,2}/\d{1,2}/\d{2})\s*</li>', re.I | re.M)
 
-        for m in DL_RE.findall(r.read()):
-            res = dict(zip(['filename','ext','description','filesize','updated'], m))
-            res['url'] = DOWNLOAD_URL % "%s.%s" % (res['filename'], res['ext'])
-            
-            if res['filename'][-2:] in self.cycles or res['filename']=='Lobby':
-                resources.append(res)  
+            for m in DL_RE.findall(html):
+                res = dict(zip(['filename','ext','description','filesize','updated'], m))
+                res['url'] = DOWNLOAD_URL % "%s.%s" % (res['filename'], res['ext'])
+                
+                if res['filename'][-2:] in self.cycles or res['filename']=='Lobby':
+                    resources.append(res)  
+                    scraped.add(rows=1)
         
         # PFD data range spreadsheet
         
@@ -181,13 +365,18 @@ class CRPDownloader(object):
     def extract(self, filename, dest_path):
         
         (path,f) = os.path.split(filename)
-        if f.endswith('.zip'):
+        if f.endswith('.zip') and not UNZIP:
+            logging.info('leaving %s zipped, loaders will stream from it' % f)
+            return
+        elif f.endswith('.zip'):
             cmd = 'unzip -u %s -d %s' % (filename, dest_path)
         else:
             cmd = 'cp %s %s' % (filename, os.path.join(dest_path,f))
                 
         logging.info( cmd )
-        os.system(cmd)
+        with metrics.stage('extract', f) as extracted:
+            os.system(cmd)
+            extracted.add(bytes=os.path.getsize(filename))
 
 
 
@@ -195,33 +384,133 @@ class CRPDownloader(object):
 if __name__ == '__main__':
     cycles = []
     sections = []
+    workers = WORKERS
+    parse_workers = PARSE_WORKERS
+    campfin_tables = CAMPFIN_TABLES
+    index_profile = INDEX_PROFILE
+    max_rejects = MAX_REJECTS
+    processes = True
+    force = False
+    swap = False
+    partitioned = False
+    summaries = False
+    incremental = False
+    delta = False
+    donors = False
+    compact = False
+    resume = False
+    pipeline = False
+    parquet = None
 
     args = sys.argv[1:]
     for arg in args:
+        if arg.startswith('--metrics='):
+            #a .jsonl or .prom file; the path keeps its case
+            metrics.sinks.append(sink(arg.split('=',1)[1]))
+            continue
+        if arg.startswith('--parquet='):
+            parquet = arg.split('=',1)[1]
+            continue
         arg = arg.lower()
-        if cycle_re.match(arg):
+        if arg.startswith('--workers='):
+            workers = int(arg.split('=',1)[1])
+        elif arg.startswith('--tables='):
+            campfin_tables = [table for table in arg.split('=',1)[1].split(',') if table]
+        elif arg.startswith('--parse-workers='):
+            parse_workers = int(arg.split('=',1)[1])
+        elif arg.startswith('--max-rejects='):
+            max_rejects = int(arg.split('=',1)[1])
+        elif arg.startswith('--indexes='):
+            index_profile = arg.split('=',1)[1]
+        elif arg == '--threads':
+            processes = False
+        elif arg == '--force':
+            force = True
+        elif arg == '--swap':
+            swap = True
+        elif arg == '--partitioned':
+            partitioned = True
+        elif arg == '--summaries':
+            summaries = True
+        elif arg == '--donors':
+            donors = True
+        elif arg == '--delta':
+            delta = True
+        elif arg == '--resume':
+            resume = True
+        elif arg == '--compact':
+            compact = True
+        elif arg == '--incremental':
+            incremental = True
+        elif arg == '--pipeline':
+            pipeline = True
+        elif cycle_re.match(arg):
             year = cycle_re.match(arg).groups()[1]
             if year not in cycles: cycles.append(year)
         elif arg in POSSIBLE_SECTIONS:
             if arg not in sections: sections.append(arg)
         
-    if not len(cycles): cycles = DEFAULT_CYCLES
+    if not len(cycles): cycles = CYCLES
     if not len(sections): sections = POSSIBLE_SECTIONS
     
     logging.basicConfig(level=logging.DEBUG)
     
+    indivs = 'campfin' in sections and 'indivs' in campfin_tables
+    if resume and not indivs:
+        sys.exit("--resume only applies to crp_indivs; add it with --tables=indivs,...")
+    if donors and not indivs:
+        sys.exit("--donors indexes crp_indivs as it is loaded; add it with --tables=indivs,...")
+    if parse_workers > 1 and not indivs:
+        logging.warning("--parse-workers only applies to crp_indivs, which isn't being loaded; add it with --tables=")
+    
     #dl = CRPDownloader(cycles,sections)
     #dl.go(sections)
     
-    db = MySQLdb.connect(host=MYSQL_HOST, user=MYSQL_USER, passwd=MYSQL_PASSWORD,db=MYSQL_DB)
-    cursor = db.cursor()
+    if parquet:
+        #exporting to files, the database isn't touched
+        cursor = None
+    else:
+        db = connect()
+        cursor = db.cursor()
+    
+    #with UNZIP off the loaders read straight out of the zips in SRC_PATH
+    archives = None
+    if not UNZIP: archives = SRC_PATH
+    if pipeline and not parquet:
+        #download while loading; the loaders see each file's manifest entry as it lands
+        dl = CRPDownloader(cycles,sections)
+        manifest = dl.manifest
+    else:
+        manifest = Manifest(os.path.join(SRC_PATH, 'manifest.json'))
     
+    loaders = []
     if 'campfin' in sections:
-        CampFinDownloader(cursor,DEST_PATH,cycles).go()
+        loaders.append(CampFinDownloader(cursor,DEST_PATH,cycles,BATCH_SIZE,tables=campfin_tables,archives=archives,manifest=manifest,parse_workers=parse_workers))
+        loaders[-1].delta = delta and not parquet
+        loaders[-1].donors = donors
     if 'expend' in sections:
-        ExpendsDownloader(cursor,DEST_PATH,cycles).go()
+        loaders.append(ExpendsDownloader(cursor,DEST_PATH,cycles,archives,manifest))
     if 'lobby' in sections:
-        LobbyDownloader(cursor,DEST_PATH).go()
+        loaders.append(LobbyDownloader(cursor,DEST_PATH,archives,manifest))
+        #an export always writes every row
+        loaders[-1].incremental = incremental and not parquet
     if 'extras' in sections:
-        ExtrasDownloader(cursor,DEST_PATH,cycles).go()
-
+        loaders.append(ExtrasDownloader(cursor,DEST_PATH,cycles,BATCH_SIZE,manifest,base_url=OPENSECRETS_URL,cache_path=os.path.join(SRC_PATH,'cache')))
+    
+    for loader in loaders:
+        loader.force = force
+        loader.swap = swap
+        loader.partitioned = partitioned
+        loader.summaries = summaries
+        loader.max_rejects = max_rejects
+        loader.compact = compact and not parquet
+        loader.resume = resume and not parquet
+    
+    if parquet:
+        ParquetExporter(parquet).run(loaders)
+    elif pipeline:
+        Pipeline(dl,LoadScheduler(workers,processes,index_profile)).run(loaders,dl.get_resources(),sections)
+        db.commit()
+    else:
+        LoadScheduler(workers,processes,index_profile).run(loaders)
+        db.commit()
@@ -3,14 +3,25 @@ import MySQLdb
 import logging
 import os
 
+from loader import Loader, loadcrp, columnlist
+from source import RawSource
 
-class ExpendsDownloader(object):
+EXPENDS_COLUMNS = "(Cycle,recordnum,TransID,CRPFilerid,recipcode,pacshort,CRPRecipName,ExpCode,Amount,@Date_orig,City,State,Zip,CmteID_EF,CandID,Type,Descrip ,PG,ElecOther,EntType,Source) SET Date = STR_TO_DATE(@Date_orig, '%m/%d/%Y')"
+
+
+class ExpendsDownloader(Loader):
+
+    TABLES = ['expends']
+    PARTITIONED = ['expends']
+    RESOURCE = 'Expend'
     
-    def __init__(self,cursor,path,cycles):
+    def __init__(self,cursor,path,cycles,archives=None,manifest=None):
         
         self.cursor = cursor
         self.dest_path = path
+        self.source = RawSource(path, archives, manifest)
         self.cycles = cycles
+        self.tables = self.TABLES
         
 
     def createtables(self):
@@ -105,15 +116,16 @@ class ExpendsDownloader(object):
 
 
 
-    def populatetables(self):
- 
-        ext = ".txt"
-        for year in self.CYCLES:
-            query = "DELETE FROM crp_expends WHERE cycle='20%s';" %year
-            self.cursor.execute(query)
-            self.cursor.execute("LOAD DATA LOCAL INFILE '%s' INTO TABLE crp_expends  FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '|' (Cycle,recordnum,TransID,CRPFilerid,recipcode,pacshort,CRPRecipName,ExpCode,Amount,@Date_orig,City,State,Zip,CmteID_EF,CandID,Type,Descrip ,PG,ElecOther,EntType,Source) SET Date = STR_TO_DATE(@Date_orig, '%m/%d/%Y')" % ( os.path.join(self.dest_path, "expends" + year + ext)))
+    def sourcefile(self, table, year):
+        return table + year + ".txt"
 
 
-    def go(self):
-        self.createtables()
-        self.populatetables()
+    def fill(self, table, year):
+        name = self.sourcefile(table, year)
+        logging.info("Loading " + name)
+        if self.compact:
+            cols, clause = columnlist(EXPENDS_COLUMNS)
+            self.loadencoded(name, table, cols, clause)
+            return
+        with self.source.localpath(name) as src:
+            self.progress.add(rows=loadcrp(self.cursor, src, self.target("crp_" + table), EXPENDS_COLUMNS, self.quarantine))
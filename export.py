@@ -0,0 +1,214 @@
+"""
+Write the bulk tables out as Parquet datasets instead of loading them into
+MySQL, for scans that are better served by columnar files.
+
+Each table becomes a directory under the export path, split by cycle in the
+Cycle=20YY/ layout that pyarrow, Spark and DuckDB read as a partition
+column. The schemas come from the loaders' own CREATE TABLE statements.
+Needs pyarrow.
+"""
+
+import copy
+import datetime
+import logging
+import os
+import re
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from campfin import splitbatch
+from crpformat import readbatches
+from metrics import metrics
+from quarantine import Quarantine
+
+
+COMPRESSION = 'snappy'
+
+column_re = re.compile(r"^\s*(\w+)\s+(\w+)\s*(?:\(\s*(\d+)\s*(?:,\s*(\d+)\s*)?\))?", re.I)
+table_re = re.compile(r"CREATE TABLE\s+(?:IF NOT EXISTS\s+)?(\w+)", re.I)
+
+
+class DDLRecorder(object):
+    """Stands in for a cursor so createtables can be run to collect its DDL."""
+
+    def __init__(self):
+
+        self.statements = []
+
+
+    def execute(self, sql, args=None):
+        self.statements.append(sql)
+
+
+    def fetchone(self):
+        #expends checks whether its code table needs filling; say it doesn't
+        return (1,)
+
+
+    def fetchall(self):
+        return []
+
+
+def parseddl(sql):
+    """(table, [(column, type, scale)]) from a CREATE TABLE statement."""
+    m = table_re.search(sql)
+    if not m:
+        return None
+    columns = []
+    for line in sql[sql.index('(') + 1:].splitlines():
+        m_col = column_re.match(line)
+        if not m_col or m_col.group(1).upper() in ('INDEX', 'KEY', 'PRIMARY', 'UNIQUE'):
+            continue
+        columns.append((m_col.group(1), m_col.group(2).lower(), int(m_col.group(4) or 0)))
+    return m.group(1), columns
+
+
+def toint(value):
+    #None for anything that isn't a number, as for an empty field
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return int(float(value))
+    except (ValueError, OverflowError):
+        return None
+
+
+def tofloat(value):
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def todate(value):
+    #CRP's mm/dd/yyyy, or yyyy-mm-dd once splitindivs has been at it
+    try:
+        if value[2:3] == '/':
+            return datetime.date(int(value[6:10]), int(value[:2]), int(value[3:5]))
+        return datetime.date(int(value[:4]), int(value[5:7]), int(value[8:10]))
+    except ValueError:
+        return None
+
+
+def todatetime(value):
+    date = todate(value)
+    return date and datetime.datetime(date.year, date.month, date.day)
+
+
+def arrowtype(sqltype, scale):
+    #pyarrow type and the function that converts a field to it
+    if sqltype in ('int', 'integer', 'smallint', 'tinyint'):
+        return pyarrow.int32(), toint
+    if sqltype == 'bigint' or (sqltype == 'decimal' and not scale):
+        return pyarrow.int64(), toint
+    if sqltype == 'float':
+        return pyarrow.float32(), tofloat
+    if sqltype in ('double', 'decimal'):
+        return pyarrow.float64(), tofloat
+    if sqltype == 'date':
+        return pyarrow.date32(), todate
+    if sqltype in ('datetime', 'timestamp'):
+        return pyarrow.timestamp('s'), todatetime
+    return pyarrow.string(), None
+
+
+class ParquetExporter(object):
+
+    def __init__(self,path,compression=COMPRESSION):
+
+        if pyarrow is None:
+            raise ImportError("Parquet export needs pyarrow: pip install pyarrow")
+        self.path = path
+        self.compression = compression
+
+
+    def schemas(self, loader):
+        recorder = DDLRecorder()
+        loader = copy.copy(loader)
+        loader.cursor = recorder
+        loader.createtables()
+        schemas = {}
+        for sql in recorder.statements:
+            parsed = parseddl(sql)
+            if parsed:
+                schemas[parsed[0]] = parsed[1]
+        return schemas
+
+
+    def export(self, loader, table, year, columns):
+        name = loader.sourcefile(table, year)
+        if name is None:
+            logging.info("Not exporting %s, it isn't loaded from a file" % table)
+            return
+        fields = []
+        converters = []
+        keep = []
+        for i, (column, sqltype, scale) in enumerate(columns):
+            if year and column.lower() == 'cycle':
+                #the directory name carries the cycle
+                continue
+            arrow, converter = arrowtype(sqltype, scale)
+            fields.append(pyarrow.field(column, arrow))
+            converters.append(converter)
+            keep.append(i)
+        schema = pyarrow.schema(fields)
+        width = len(columns)
+
+        dest = os.path.join(self.path, "crp_" + table)
+        if year:
+            dest = os.path.join(dest, "Cycle=20" + year)
+        if not os.path.exists(dest):
+            os.makedirs(dest)
+        out_path = os.path.join(dest, "data.parquet")
+        tmp_path = out_path + ".tmp"
+
+        writer = pyarrow.parquet.ParquetWriter(tmp_path, schema, compression=self.compression)
+        try:
+            with metrics.stage('export', name) as exported:
+                quarantine = Quarantine(table + (year or ''), loader.rejects_path, loader.max_rejects, exported)
+                try:
+                    for rows in readbatches(loader.source.open(name, 'rb')):
+                        if table == 'indivs':
+                            #set aside rows that can't be split, as the load does
+                            rows = splitbatch(rows, quarantine)
+                        else:
+                            #rows cut short or running long are fitted to the table, as LOAD DATA does
+                            rows = [(row + [''] * (width - len(row)))[:width] for row in rows]
+                        if not rows:
+                            continue
+                        data = zip(*rows)
+                        arrays = []
+                        for values, field, converter in zip([data[i] for i in keep], fields, converters):
+                            if converter:
+                                values = [converter(value) for value in values]
+                            arrays.append(pyarrow.array(values, type=field.type))
+                        writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+                        exported.add(rows=len(rows))
+                finally:
+                    quarantine.close()
+        finally:
+            writer.close()
+        os.rename(tmp_path, out_path)
+
+
+    def run(self, loaders):
+        for loader in loaders:
+            schemas = self.schemas(loader)
+            for table, year in loader.jobs():
+                if "crp_" + table not in schemas:
+                    logging.info("Not exporting %s, no schema for it" % table)
+                    continue
+                #swap jobs cover several cycles, but each is its own partition here
+                years = isinstance(year, tuple) and list(year) or [year]
+                for year in years:
+                    self.export(loader, table, year, schemas["crp_" + table])
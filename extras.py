@@ -9,7 +9,6 @@ Windows users can connect to this database in Microsoft Access if you prefer by
 Luke Rosiak
 """
 
-import pyExcelerator
 import cookielib
 import csv
 import datetime
@@ -18,24 +17,44 @@ import os
 import re
 import sys
 import urllib, urllib2
-from BeautifulSoup import BeautifulSoup
+from multiprocessing.pool import ThreadPool
 
+from httpcache import HTTPCache
+from loader import Loader, BatchInserter, BATCH_SIZE
+from metrics import metrics
+from source import RawSource
+from workbook import cachedsheets
 
 
-class ExtrasDownloader(object):
+OPENSECRETS_URL = "http://www.opensecrets.org"
+LEADPACS_URL = "%s/pacs/industry.php?txt=Q03&cycle=20%s"
+leadpacs_re = re.compile( r'strID=(C\d+)">(.{5,50})</a>\s*</td>\s*<td>\s*<a href="/politicians/summary.php\?cid=(N\d{8})')
+
+#cycles fetched at once
+SCRAPE_WORKERS = 4
+
+
+class ExtrasDownloader(Loader):
+
+    TABLES = ['ids', 'leadpacs']
     
-    def __init__(self,cursor,path,cycles):
+    def __init__(self,cursor,path,cycles,batch_size=BATCH_SIZE,manifest=None,tables=None,base_url=OPENSECRETS_URL,cache_path=None):
         
         self.cursor = cursor
         self.path = path
+        self.source = RawSource(path, manifest=manifest)
         self.cycles = cycles
+        self.batch_size = batch_size
+        self.tables = tables or self.TABLES
+        self.base_url = base_url
+        self.cache_path = cache_path or os.path.join(path, 'cache')
+        self.cache = HTTPCache(self.cache_path)
         
  
     #these tables all come from the multi-paned Excel worksheet: categories, members, congcmtes, congcmte_posts
     def createtables(self):
         queries = [
-            "DROP TABLE IF EXISTS crp_categories;",
-                """CREATE TABLE crp_categories(
+                """CREATE TABLE IF NOT EXISTS crp_categories(
 	            catcode varchar (5) NOT NULL,
 	            catname varchar (50) NOT NULL,
 	            catorder varchar (3) NOT NULL,
@@ -52,8 +71,7 @@ class ExtrasDownloader(object):
 	            office varchar (4) NOT NULL,
                 PRIMARY KEY (congno, cid)
                 );""",
-                "DROP TABLE IF EXISTS crp_congcmtes;",
-                """CREATE TABLE crp_congcmtes(
+                """CREATE TABLE IF NOT EXISTS crp_congcmtes(
 	            code varchar(5) NOT NULL,
 	            title varchar (70) NOT NULL,
 	            INDEX (code)
@@ -73,122 +91,120 @@ class ExtrasDownloader(object):
         
 
  
-        cursor = self.db.cursor()
         for query in queries:
-            cursor.execute(query)
-
-
-
-    def populatetables(self):
-
-        def writerowsfromcsv(file, table):
-            def linereader(path):
-                infile = open(path, 'rU')
-                for line in infile:
-                    line = unicode(line, 'ascii', 'ignore').replace('\n', '')
-                    yield line
-                infile.close()
-            
-            detailReader =  csv.reader(linereader(file), quotechar='|')
-            writerows(detailReader, table)
-
-        def writerows(rows, table):
-
-            def reformatdate(date):
-                return date[6:] + '-' + date[:2] + '-' + date[3:5]
-
-            logging.info("Writing " + table)
-            cursor = self.db.cursor()
-            for row in rows:
-                if len(row)>0:
-                    sql = "INSERT INTO crp_" + table + " VALUES ("
-                    for f in row:
-                        f = f.decode('iso8859-1').encode('utf-8','ignore').strip()
-                        sql = sql+' %s,'
-                    sql = sql[:-1]+");"
-                    try:
-                        cursor.execute(sql,row) 
-                    except:
-                        print( "This FAILED:" + sql + str(row) ) 
-                        logging.info( "This FAILED:" + sql + str(row) )
-                        pass
-
-        def parseExcelIDs(f):
-            def sheetToRows(values):
-                matrix = [[]]
-                for row_idx, col_idx in sorted(values.keys()):
-                    v = values[(row_idx, col_idx)]
-                    if isinstance(v, unicode):
-                        v = v.encode('cp866', 'backslashreplace')
-                    else:
-                        v = str(v)
-                    last_row, last_col = len(matrix), len(matrix[-1])
-                    while last_row < row_idx:
-                        matrix.extend([[]])
-                        last_row = len(matrix)
-
-                    while last_col < col_idx:
-                        matrix[-1].extend([''])
-                        last_col = len(matrix[-1])
-
-                    matrix[-1].extend([v])
-                return matrix
-
-            grabsheets = [('Members', 'members', [0,2,3,4]), ('CRP Industry Codes', 'categories', [0,1,2,3,4,5]), 
-                ('Congressional Cmte Codes', 'congcmtes',[0,1]), ('Congressional Cmte Assignments', 'congcmte_posts', [0,2,3,4])] 
-
-            #members: 0,2,4,3 for 2012
-
-            for sheet_name, values in pyExcelerator.parse_xls(f): 
-                matrix = [[]]
-                sheet_title = sheet_name.encode('cp866', 'backslashreplace')
-                for sheet_info in grabsheets:
-                    if sheet_title.startswith(sheet_info[0]):
-                        matrix = sheetToRows(values)
-                        newmatrix = []
-                        prefix = None #special case-make this the first value for all records in worksheet
-                        if sheet_title.startswith('Members'):
-                            prefix = sheet_title[-5:-2]
-                        for row in matrix:
-                            if len(row)>0 and not row[1].startswith("This information is being made available"):
-                                newrow = []
-                                if prefix:
-                                    newrow.append(prefix)
-                                for i in sheet_info[2]:
-                                    if sheet_info[1]=='congcmte_posts' and i==4 and len(row)<5:
-                                        thisval = ''
-                                    else:
-                                        thisval = row[i]
-                                    try:                        
-                                        newrow.append( thisval )
-                                    except:
-                                        logging.info( str(row) + " failed" )
-                                newmatrix.append(newrow)
-                        #get rid of headers
-                        if sheet_info[1] in ['members', 'categories', 'congcmtes', 'congcmte_posts']:
-                            newmatrix = newmatrix[1:]
-                        writerows(newmatrix,sheet_info[1])
-
-
-        parseExcelIDs(os.path.join(self.path,"CRP_IDs.xls"))
-
+            self.cursor.execute(query)
+
+
+
+    def writerows(self, rows, table):
+        logging.info("Writing " + table)
+        inserter = BatchInserter(self.cursor, self.target("crp_" + table), batch_size=self.batch_size, stage=self.progress, quarantine=self.quarantine)
+        for row in rows:
+            if len(row)>0:
+                inserter.add(row)
+        inserter.close()
+
+
+    def parseExcelIDs(self, f):
+        grabsheets = [('Members', 'members', [0,2,3,4]), ('CRP Industry Codes', 'categories', [0,1,2,3,4,5]), 
+            ('Congressional Cmte Codes', 'congcmtes',[0,1]), ('Congressional Cmte Assignments', 'congcmte_posts', [0,2,3,4])] 
+
+        #members: 0,2,4,3 for 2012
+
+        def sheetrows(sheet_title, sheet_info, matrix):
+            prefix = None #special case-make this the first value for all records in worksheet
+            if sheet_title.startswith('Members'):
+                prefix = sheet_title[-5:-2]
+            header = True
+            for row in matrix:
+                if len(row)>0 and not row[1].startswith("This information is being made available"):
+                    #get rid of headers
+                    if header:
+                        header = False
+                        continue
+                    newrow = []
+                    if prefix:
+                        newrow.append(prefix)
+                    for i in sheet_info[2]:
+                        if sheet_info[1]=='congcmte_posts' and i==4 and len(row)<5:
+                            newrow.append('')
+                        else:
+                            newrow.append(row[i])
+                    yield newrow
+
+        with metrics.stage('parse', os.path.basename(f)) as parsed:
+            sheets = cachedsheets(f, [sheet_info[0] for sheet_info in grabsheets], self.cache_path)
+            parsed.add(bytes=os.path.getsize(f))
+
+        for sheet_title, matrix in sheets:
+            for sheet_info in grabsheets:
+                if sheet_title.startswith(sheet_info[0]):
+                    self.writerows(sheetrows(sheet_title, sheet_info, matrix), sheet_info[1])
+
+
+    def leadpacsurl(self, year):
+        return LEADPACS_URL % (self.base_url, year)
+
+
+    def scrape(self, years):
+        #warm the cache for every cycle at once, so the load jobs read pages from disk
+        def fetch(year):
+            with metrics.stage('scrape', 'leadpacs' + year) as scraped:
+                scraped.add(bytes=len(self.cache.get(self.leadpacsurl(year))))
+        pool = ThreadPool(max(min(SCRAPE_WORKERS, len(years)), 1))
+        try:
+            pool.map(fetch, years)
+        finally:
+            pool.close()
+            pool.join()
+
+
+    def leadpacs(self, year):
+        #(cycle, cid, cmteid) for each PAC whose lead candidate is linked
+        html = self.cache.get(self.leadpacsurl(year))
         leadpacs = []
-        r = re.compile( r'strID=C(\d+)">(.{5,50})</a>\s*</td>\s*<td>\s*<a href="/politicians/summary.php\?cid=N(\d{8})')
-        for year in CYCLES:
-            html = urllib2.urlopen("http://www.opensecrets.org/pacs/industry.php?txt=Q03&cycle=20"+year).read()
-            table = BeautifulSoup(html).findAll('table')[2]
-            rows = table.findAll('tr')
-            for row in rows[1:]:
-                cells = row.findAll('td')
-                cmteid = cells[0].a['href'][-9:]
-                if cells[1].a:
-                    cid = cells[1].a['href'][len('/politicians/summary.php?cid='):][:9]
-                    pair = ["20"+year, cid, cmteid]
-                    if pair not in leadpacs:
-                        leadpacs.append(pair)
-        writerows(leadpacs,"leadpacs")    
+        seen = set()
+        for cmteid, name, cid in leadpacs_re.findall(html):
+            if (cid, cmteid) not in seen:
+                seen.add((cid, cmteid))
+                leadpacs.append(["20"+year, cid, cmteid])
+        return leadpacs
 
-        
-    def go(self):
-        self.createtables()
-        self.populatetables()
+
+    def setup(self):
+        Loader.setup(self)
+        if 'leadpacs' in self.tables:
+            self.scrape(self.cycles)
+
+
+    def jobs(self):
+        #the ID spreadsheet isn't split by cycle; lead PACs are scraped per cycle
+        jobs = []
+        if 'ids' in self.tables:
+            jobs.append(('ids', None))
+        return jobs + self.cyclejobs([table for table in self.tables if table=='leadpacs'])
+
+
+    def resource(self, table, year):
+        if table=='ids':
+            return "CRP_IDs"
+        return None
+
+
+    def sourcefile(self, table, year):
+        if table=='ids':
+            return "CRP_IDs.xls"
+        return None
+
+
+    def loadtable(self, table, years):
+        if table=='ids':
+            #one spreadsheet fills all four tables; they're cleared here rather than dropped in createtables so an unchanged file can be skipped
+            tables = ["crp_" + sheet_table for sheet_table in ['categories', 'members', 'congcmtes', 'congcmte_posts']]
+            self.replace(tables, years, lambda year: self.parseExcelIDs(os.path.join(self.path,self.sourcefile(table, year))))
+        else:
+            Loader.loadtable(self, table, years)
+
+
+    def fill(self, table, year):
+        self.writerows(self.leadpacs(year), "leadpacs")
@@ -0,0 +1,79 @@
+"""
+An on-disk cache for the pages the loaders scrape. Stored pages are served
+as they are for max_age seconds after they were last checked, and after
+that revalidated with If-None-Match/If-Modified-Since, so an unchanged page
+costs a 304 rather than a full download.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+import urllib2
+
+
+MAX_AGE = 3600
+
+
+class HTTPCache(object):
+
+    def __init__(self,path,max_age=MAX_AGE):
+
+        self.path = path
+        self.max_age = max_age
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+
+    def paths(self, url):
+        key = os.path.join(self.path, hashlib.md5(url).hexdigest())
+        return key + '.html', key + '.json'
+
+
+    def get(self, url):
+        body_path, meta_path = self.paths(url)
+        meta = None
+        if os.path.exists(body_path) and os.path.exists(meta_path):
+            meta = json.load(open(meta_path))
+            if time.time() - meta['checked'] < self.max_age:
+                return open(body_path, 'rb').read()
+
+        request = urllib2.Request(url)
+        if meta and meta.get('etag'):
+            request.add_header('If-None-Match', meta['etag'])
+        if meta and meta.get('last_modified'):
+            request.add_header('If-Modified-Since', meta['last_modified'])
+        try:
+            r = urllib2.urlopen(request)
+            body = r.read()
+            headers = r.info()
+            r.close()
+        except urllib2.HTTPError, e:
+            if e.code != 304 or meta is None:
+                raise
+            logging.info("%s is unchanged" % url)
+            meta['checked'] = time.time()
+            self.save(meta_path, meta)
+            return open(body_path, 'rb').read()
+
+        #body first, so a meta file always has its page next to it
+        self.save(body_path, body)
+        self.save(meta_path, {
+            'url': url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'checked': time.time(),
+        })
+        return body
+
+
+    def save(self, path, data):
+        tmp_path = "%s.%i.tmp" % (path, os.getpid())
+        outfile = open(tmp_path, 'wb')
+        if isinstance(data, dict):
+            json.dump(data, outfile)
+        else:
+            outfile.write(data)
+        outfile.close()
+        os.rename(tmp_path, path)
@@ -0,0 +1,79 @@
+"""
+Named sets of extra indexes for the big tables, built once the bulk load is
+done rather than maintained row by row while it runs.
+
+minimal keeps just the keys in the CREATE TABLE statements; analytics adds
+the columns the tables are usually joined on; full adds the common filters
+as well. Each table's indexes are built one after another on a connection of
+its own, and different tables are indexed at the same time.
+"""
+
+import logging
+import time
+from multiprocessing.pool import ThreadPool
+
+from loader import connect, secondaryindexes
+from metrics import metrics
+
+
+ANALYTICS = {
+    'crp_indivs': [('ix_recipid', 'RecipID'), ('ix_contribid', 'ContribID'), ('ix_cmteid', 'CmteID'), ('ix_realcode', 'RealCode')],
+    'crp_pacs': [('ix_cid', 'CID'), ('ix_realcode', 'RealCode')],
+    'crp_pac_other': [('ix_filerid', 'FilerID'), ('ix_recipid', 'RecipID'), ('ix_realcode', 'Realcode')],
+    'crp_expends': [('ix_crpfilerid', 'CRPFilerid'), ('ix_expcode', 'ExpCode')],
+}
+
+FULL = {
+    'crp_indivs': ANALYTICS['crp_indivs'] + [('ix_ultorg', 'UltOrg'), ('ix_name', 'lastname, first3'), ('ix_zip', 'Zip'), ('ix_date', 'Date')],
+    'crp_pacs': ANALYTICS['crp_pacs'] + [('ix_feccandid', 'FECCandID'), ('ix_date', 'Date')],
+    'crp_pac_other': ANALYTICS['crp_pac_other'] + [('ix_otherid', 'OtherID'), ('ix_date', 'Date')],
+    'crp_expends': ANALYTICS['crp_expends'] + [('ix_candid', 'CandID'), ('ix_cmteid_ef', 'CmteID_EF'), ('ix_date', 'Date')],
+}
+
+INDEX_PROFILES = {
+    'minimal': {},
+    'analytics': ANALYTICS,
+    'full': FULL,
+}
+
+
+def indextable(job):
+    #runs in a pool thread: builds one table's missing indexes in turn
+    table, indexes = job
+    timings = []
+    db = connect()
+    try:
+        cursor = db.cursor()
+        cursor.execute("SHOW TABLES LIKE %s", (table,))
+        if not cursor.fetchone():
+            return timings
+        existing = [name for name, clause in secondaryindexes(cursor, table)]
+        for name, columns in indexes:
+            if name in existing:
+                continue
+            start = time.time()
+            with metrics.stage('index', "%s.%s" % (table, name)):
+                cursor.execute("ALTER TABLE %s ADD INDEX `%s` (%s)" % (table, name, columns))
+            timings.append((table, name, time.time() - start))
+    finally:
+        db.close()
+    return timings
+
+
+def buildindexes(profile, workers=None):
+    """Adds the indexes of the named profile that the tables don't have yet, on
+    workers tables at a time, by default all of them."""
+    jobs = sorted(INDEX_PROFILES[profile].items())
+    if not jobs:
+        return []
+    pool = ThreadPool(max(min(workers or len(jobs), len(jobs)), 1))
+    timings = []
+    try:
+        for built in pool.imap_unordered(indextable, jobs):
+            timings.extend(built)
+    finally:
+        pool.close()
+        pool.join()
+    for table, name, elapsed in timings:
+        logging.info("Built %s on %s in %.1fs" % (name, table, elapsed))
+    return timings
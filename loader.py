@@ -0,0 +1,534 @@
+"""
+Shared plumbing for writing CRP rows into MySQL.
+"""
+
+import logging
+import MySQLdb
+
+from metrics import metrics
+from quarantine import Quarantine, reasoncode, REJECTS_PATH, MAX_REJECTS
+from source import fifo
+from summary import createsummaries, refresh
+
+
+BATCH_SIZE = 5000
+
+
+def cleanfield(f):
+    return f.decode('iso8859-1').encode('utf-8','ignore').strip()
+
+
+class BatchInserter(object):
+    """Buffers rows bound for one table and writes them with executemany, which
+    MySQLdb turns into a single multi-row INSERT per batch. The statement is
+    built once, from the width of the first row; rows of another width, and
+    rows MySQL won't take, go to quarantine."""
+
+    def __init__(self,cursor,table,cols=None,batch_size=BATCH_SIZE,stage=None,quarantine=None):
+
+        self.cursor = cursor
+        self.table = table
+        self.cols = cols
+        self.batch_size = batch_size
+        self.stage = stage
+        self.quarantine = quarantine or Quarantine(table)
+        self.sql = None
+        self.width = cols and len(cols)
+        self.rows = []
+        self.count = 0
+
+
+    def template(self, width):
+        cols = ''
+        if self.cols:
+            cols = ' (%s)' % ','.join(self.cols)
+        return "INSERT INTO %s%s VALUES (%s)" % (self.table, cols, ','.join(['%s'] * width))
+
+
+    def add(self, row):
+        self.addbatch([tuple([cleanfield(f) for f in row])])
+
+
+    def addbatch(self, rows):
+        #rows already cleaned, as crpformat.readbatches yields them
+        if not rows:
+            return
+        if self.sql is None:
+            self.width = self.width or len(rows[0])
+            self.sql = self.template(self.width)
+        for row in rows:
+            if len(row) == self.width:
+                self.rows.append(row)
+            else:
+                self.quarantine.reject(row, 'width')
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+
+    def flush(self):
+        if not self.rows:
+            return
+        loaded = len(self.rows)
+        try:
+            self.cursor.executemany(self.sql, self.rows)
+        except MySQLdb.Error:
+            #one bad row fails the whole statement, so retry just this batch row by row
+            loaded = 0
+            for row in self.rows:
+                try:
+                    self.cursor.execute(self.sql, row)
+                    loaded += 1
+                except MySQLdb.Error, e:
+                    self.quarantine.reject(row, reasoncode(e))
+        self.count += loaded
+        if self.stage:
+            self.stage.add(rows=loaded)
+        self.rows = []
+
+
+    def close(self):
+        self.flush()
+        logging.info("Wrote %i rows to %s" % (self.count, self.table))
+
+
+def escapefield(f):
+    return f.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+class StagingFile(object):
+    """Same interface as BatchInserter, but writes rows to outfile, tab-separated
+    in LOAD DATA's default format, so they can be bulk-loaded by the server."""
+
+    def __init__(self,outfile,stage=None):
+
+        self.outfile = outfile
+        self.stage = stage
+        self.count = 0
+
+
+    def add(self, row):
+        line = '\t'.join([escapefield(cleanfield(f)) for f in row]) + '\n'
+        self.outfile.write(line)
+        self.count += 1
+        if self.stage:
+            self.stage.add(rows=1, bytes=len(line))
+
+
+    def addbatch(self, rows):
+        #rows already cleaned; only fields with a tab or backslash need escaping
+        if not rows:
+            return
+        lines = []
+        for row in rows:
+            line = '\t'.join(row)
+            if '\\' in line or line.count('\t') != len(row) - 1 or '\n' in line:
+                line = '\t'.join([escapefield(f) for f in row])
+            lines.append(line)
+        data = '\n'.join(lines) + '\n'
+        self.outfile.write(data)
+        self.count += len(rows)
+        if self.stage:
+            self.stage.add(rows=len(rows), bytes=len(data))
+
+
+    def close(self):
+        logging.info("Staged %i rows" % self.count)
+
+
+def loadwarnings(cursor, quarantine):
+    """Hands the warnings left by the last statement to quarantine. LOAD DATA
+    LOCAL turns every error in a row into a warning, so this is the only sign
+    of rows that were dropped or had values changed."""
+    cursor.execute("SHOW COUNT(*) WARNINGS")
+    row = cursor.fetchone()
+    count = row and row[0] or 0
+    if not count:
+        return
+    cursor.execute("SHOW WARNINGS")
+    quarantine.warned([(code, message) for level, code, message in cursor.fetchall()], count)
+
+
+def loadstaged(cursor, path, table, cols, clause='', quarantine=None):
+    #clause is an optional SET clause; returns the number of rows loaded
+    cursor.execute("LOAD DATA LOCAL INFILE '%s' INTO TABLE %s CHARACTER SET utf8 (%s)%s" % (path, table, ','.join(cols), clause))
+    loaded = cursor.rowcount
+    if quarantine:
+        loadwarnings(cursor, quarantine)
+    return loaded
+
+
+def columnlist(columns):
+    #a LOAD DATA column list and SET clause, as taken by loadcrp, split for loadstaged
+    cols, clause = columns.split(')', 1)
+    return [col.strip() for col in cols.lstrip('(').split(',')], clause
+
+
+def loadcrp(cursor, path, table, columns='', quarantine=None):
+    """LOAD DATA for a file in CRP's comma-separated, pipe-quoted format. columns
+    is an optional column list and SET clause appended to the statement. Returns
+    the number of rows loaded; any warnings go to quarantine, if given."""
+    cursor.execute("LOAD DATA LOCAL INFILE '" + path + "' INTO TABLE " + table + " FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '|' " + columns)
+    loaded = cursor.rowcount
+    if quarantine:
+        loadwarnings(cursor, quarantine)
+    return loaded
+
+
+def connect():
+    from credentials import MYSQL_HOST, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DB
+    return MySQLdb.connect(host=MYSQL_HOST, user=MYSQL_USER, passwd=MYSQL_PASSWORD, db=MYSQL_DB, local_infile=1)
+
+
+LOADS_TABLE = """CREATE TABLE IF NOT EXISTS crp_loads(
+                tablename varchar(20) NOT NULL,
+                cycle varchar(4) NOT NULL,
+                fingerprint varchar(64) NOT NULL,
+                loaded datetime NOT NULL,
+                PRIMARY KEY (tablename, cycle)
+                );"""
+
+
+#how far an unfinished load of a file got, as of its last commit
+CHECKPOINTS_TABLE = """CREATE TABLE IF NOT EXISTS crp_checkpoints(
+                tablename varchar(20) NOT NULL,
+                cycle varchar(4) NOT NULL,
+                fingerprint varchar(64) NOT NULL,
+                byte_offset bigint NOT NULL,
+                row_count int NOT NULL,
+                loaded datetime NOT NULL,
+                PRIMARY KEY (tablename, cycle)
+                );"""
+
+
+SHADOW = "__new"
+
+
+def tablecolumns(cursor, table):
+    cursor.execute("SHOW COLUMNS FROM " + table)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def secondaryindexes(cursor, table):
+    """(name, ADD INDEX clause) for each non-primary index on table, from SHOW INDEX."""
+    cursor.execute("SHOW INDEX FROM " + table)
+    indexes = {}
+    order = []
+    for row in cursor.fetchall():
+        non_unique, name, column, sub_part = row[1], row[2], row[4], row[7]
+        if name == 'PRIMARY':
+            continue
+        if name not in indexes:
+            indexes[name] = (non_unique, [])
+            order.append(name)
+        if sub_part:
+            column = "%s(%s)" % (column, sub_part)
+        indexes[name][1].append(column)
+    clauses = []
+    for name in order:
+        non_unique, columns = indexes[name]
+        unique = ''
+        if not int(non_unique):
+            unique = 'UNIQUE '
+        clauses.append((name, "ADD %sINDEX `%s` (%s)" % (unique, name, ','.join(columns))))
+    return clauses
+
+
+class Loader(object):
+    """Base for the section downloaders. A section is loaded as a list of
+    independent (table, year) jobs, so the scheduler can hand them out to
+    separate connections; year is None for tables not split by cycle.
+
+    Subclasses fill(table, year) by loading into self.target(...), adding the
+    rows they write to self.progress and handing rows they can't load to
+    self.quarantine. With swap set, the rows go into a shadow copy of the table
+    that is renamed over the original once it is complete, so readers never see
+    a half-loaded table."""
+
+    TABLES = []
+    #tables that are LIST-partitioned by Cycle when partitioned is set
+    PARTITIONED = []
+    #the bulk download the files come in, named with the cycle for per-cycle sections
+    RESOURCE = None
+    force = False
+    swap = False
+    partitioned = False
+    #keep the summary tables up to date as cycles are loaded
+    summaries = False
+    targets = {}
+    #the metrics Stage of the running load job
+    progress = None
+    #where the running job's rejected rows go, and how many it may reject
+    quarantine = None
+    rejects_path = REJECTS_PATH
+    max_rejects = MAX_REJECTS
+    #keep code columns as ids into dimension tables, see compact.py
+    compact = False
+    #commit big files a chunk at a time and pick up where an unfinished load stopped
+    resume = False
+
+    def ispartitioned(self, table):
+        return self.partitioned and table in self.PARTITIONED
+
+
+    def cyclejobs(self, tables):
+        jobs = []
+        for table in tables:
+            if self.swap and not self.ispartitioned(table):
+                #a shadow table replaces the whole table, so one job loads all its cycles
+                jobs.append((table, tuple(self.cycles)))
+            else:
+                jobs.extend([(table, year) for year in self.cycles])
+        return jobs
+
+
+    def jobs(self):
+        return self.cyclejobs(self.tables)
+
+
+    def sourcefile(self, table, year):
+        #the file a job loads from, if any; jobs without one are always reloaded
+        return None
+
+
+    def resource(self, table, year):
+        #the download a job has to wait for in pipeline mode
+        if self.RESOURCE is None:
+            return None
+        return self.RESOURCE + (year or '')
+
+
+    def target(self, table):
+        #the table fill should write into; replace points this at shadow tables while it runs
+        return self.targets.get(table, table)
+
+
+    def fill(self, table, year):
+        raise NotImplementedError
+
+
+    def encoder(self, table, cols):
+        #in compact mode, an Encoder for rows of table with columns cols
+        from compact import COMPACT_COLUMNS, Encoder
+        if self.compact and table in COMPACT_COLUMNS:
+            return Encoder(self.cursor, table, cols)
+        return None
+
+
+    def loadencoded(self, name, table, cols, clause=''):
+        """Loads name into table through a staging file, so the code columns can
+        be encoded on the way; cols and clause are as for loadstaged."""
+        from compact import stageencoded
+        encoder = self.encoder(table, cols)
+        def stage(outfile):
+            stageencoded(self.source.open(name, 'rb'), outfile, encoder, len(cols), self.quarantine)
+        try:
+            with fifo(stage) as staged:
+                self.progress.add(rows=loadstaged(self.cursor, staged, self.target("crp_" + table), cols, clause, self.quarantine))
+        finally:
+            encoder.close()
+
+
+    def loadtable(self, table, years):
+        self.replace(["crp_" + table], years, lambda year: self.fill(table, year))
+
+
+    def cyclefilter(self, years):
+        if years == [None]:
+            return ''
+        return " WHERE cycle IN (%s)" % ','.join(["'20%s'" % year for year in years])
+
+
+    def replace(self, tables, years, fill):
+        """Empties tables for years (all of them if years is [None]) and calls
+        fill(year) for each year to load them again."""
+        if years != [None] and all([self.ispartitioned(table[len("crp_"):]) for table in tables]):
+            self.replacepartitions(tables, years, fill)
+        elif self.swap:
+            self.swaptables(tables, years, fill)
+        else:
+            for table in tables:
+                self.cursor.execute("DELETE FROM " + table + self.cyclefilter(years))
+            for year in years:
+                fill(year)
+
+
+    def shadowcopy(self, table, shadow):
+        """Creates shadow as an empty copy of table without its secondary indexes,
+        which are returned so they can be built once the rows are in."""
+        self.cursor.execute("DROP TABLE IF EXISTS " + shadow)
+        self.cursor.execute("CREATE TABLE %s LIKE %s" % (shadow, table))
+        indexes = secondaryindexes(self.cursor, shadow)
+        for name, clause in indexes:
+            self.cursor.execute("ALTER TABLE %s DROP INDEX `%s`" % (shadow, name))
+        return indexes
+
+
+    def addindexes(self, shadow, indexes):
+        if indexes:
+            logging.info("Indexing " + shadow)
+            with metrics.stage('index', shadow):
+                self.cursor.execute("ALTER TABLE %s %s" % (shadow, ', '.join([clause for name, clause in indexes])))
+
+
+    def swaptables(self, tables, years, fill):
+        indexes = {}
+        for table in tables:
+            indexes[table] = self.shadowcopy(table, table + SHADOW)
+            if years != [None]:
+                #cycles that aren't being reloaded carry over as they are
+                self.cursor.execute("INSERT INTO %s SELECT * FROM %s%s" % (table + SHADOW, table, self.cyclefilter(years).replace(' IN ', ' NOT IN ')))
+
+        self.targets = dict([(table, table + SHADOW) for table in tables])
+        try:
+            for year in years:
+                fill(year)
+        finally:
+            self.targets = {}
+
+        renames = []
+        for table in tables:
+            self.addindexes(table + SHADOW, indexes[table])
+            self.cursor.execute("DROP TABLE IF EXISTS %s__old" % table)
+            renames.append("%s TO %s__old, %s TO %s" % (table, table, table + SHADOW, table))
+        self.cursor.execute("RENAME TABLE " + ', '.join(renames))
+        for table in tables:
+            self.cursor.execute("DROP TABLE %s__old" % table)
+
+
+    def replacepartitions(self, tables, years, fill):
+        """Each cycle is its own partition: it is either truncated and refilled, or
+        with swap set, built in a plain table and exchanged in atomically."""
+        for year in years:
+            partition = "p20" + year
+            if not self.swap:
+                for table in tables:
+                    self.cursor.execute("ALTER TABLE %s TRUNCATE PARTITION %s" % (table, partition))
+                fill(year)
+                continue
+
+            indexes = {}
+            for table in tables:
+                exchange = "%s__%s" % (table, partition)
+                indexes[table] = self.shadowcopy(table, exchange)
+                self.cursor.execute("ALTER TABLE %s REMOVE PARTITIONING" % exchange)
+            self.targets = dict([(table, "%s__%s" % (table, partition)) for table in tables])
+            try:
+                fill(year)
+            finally:
+                self.targets = {}
+            for table in tables:
+                exchange = "%s__%s" % (table, partition)
+                self.addindexes(exchange, indexes[table])
+                self.cursor.execute("ALTER TABLE %s EXCHANGE PARTITION %s WITH TABLE %s" % (table, partition, exchange))
+                #the exchange table now holds the old rows
+                self.cursor.execute("DROP TABLE " + exchange)
+
+
+    def partition(self, table):
+        """LIST-partitions table by Cycle if it isn't already, and adds a partition
+        for any cycle being loaded that doesn't have one yet."""
+        def definition(cycle):
+            return "PARTITION p%s VALUES IN ('%s')" % (cycle, cycle)
+
+        self.cursor.execute("SELECT PARTITION_NAME FROM information_schema.PARTITIONS WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s", (table,))
+        existing = [row[0] for row in self.cursor.fetchall() if row[0]]
+        cycles = ["20" + year for year in self.cycles]
+        if not existing:
+            self.cursor.execute("SELECT DISTINCT Cycle FROM " + table)
+            cycles = sorted(set(cycles + [row[0] for row in self.cursor.fetchall()]))
+            logging.info("Partitioning %s by cycle" % table)
+            self.cursor.execute("ALTER TABLE %s PARTITION BY LIST COLUMNS(Cycle) (%s)" % (table, ', '.join([definition(cycle) for cycle in cycles])))
+        else:
+            missing = [cycle for cycle in cycles if "p" + cycle not in existing]
+            if missing:
+                self.cursor.execute("ALTER TABLE %s ADD PARTITION (%s)" % (table, ', '.join([definition(cycle) for cycle in missing])))
+
+
+    def lastload(self, table, year):
+        self.cursor.execute("SELECT fingerprint FROM crp_loads WHERE tablename=%s AND cycle=%s", (table, year or ''))
+        row = self.cursor.fetchone()
+        return row and row[0]
+
+
+    def lastcheckpoint(self, table, year):
+        #(fingerprint, byte offset, rows) of an unfinished load, or None
+        self.cursor.execute("SELECT fingerprint, byte_offset, row_count FROM crp_checkpoints WHERE tablename=%s AND cycle=%s", (table, year or ''))
+        return self.cursor.fetchone()
+
+
+    def checkpoint(self, table, year, fingerprint, offset, rows):
+        """Records how far table's file has been loaded and commits it along with
+        the rows, so a later load can pick up from here."""
+        self.cursor.execute("REPLACE INTO crp_checkpoints VALUES (%s, %s, %s, %s, %s, NOW())", (table, year or '', fingerprint, offset, rows))
+        self.cursor.connection.commit()
+
+
+    def load(self, table, year):
+        """loadtable for the years whose source file differs from the one the last
+        successful load used. year is a tuple of years for swap jobs."""
+        if isinstance(year, tuple):
+            years = list(year)
+        else:
+            years = [year]
+
+        changed = []
+        fingerprints = {}
+        for year in years:
+            name = self.sourcefile(table, year)
+            fingerprints[year] = name and self.source.fingerprint(name)
+            if fingerprints[year] and not self.force and fingerprints[year] == self.lastload(table, year):
+                logging.info("Skipping %s%s, %s is unchanged since the last load" % (table, year or '', name))
+            else:
+                changed.append(year)
+        if not changed:
+            return
+
+        name = table + ','.join([year or '' for year in changed])
+        with metrics.stage('load', name) as self.progress:
+            self.quarantine = Quarantine(name, self.rejects_path, self.max_rejects, self.progress)
+            try:
+                self.loadtable(table, changed)
+            finally:
+                self.quarantine.close()
+        if self.summaries:
+            refresh(self.cursor, table, changed, self.compact)
+        for year in changed:
+            if fingerprints[year]:
+                self.cursor.execute("REPLACE INTO crp_loads VALUES (%s, %s, %s, NOW())", (table, year or '', fingerprints[year]))
+
+
+    def setup(self):
+        self.createtables()
+        self.cursor.execute(LOADS_TABLE)
+        self.cursor.execute(CHECKPOINTS_TABLE)
+        if self.summaries:
+            createsummaries(self.cursor)
+        from compact import compacted, compacttables
+        if not self.compact:
+            found = compacted(self.cursor, self.tables)
+            if found:
+                #loading codes into id columns would turn them into zeros
+                logging.warning("%s already in compact form, loading with --compact" % ', '.join(["crp_" + table for table in found]))
+                self.compact = True
+        if self.compact:
+            compacttables(self.cursor, self.tables)
+        if self.partitioned:
+            for table in self.PARTITIONED:
+                self.partition("crp_" + table)
+
+
+    def populatetables(self):
+        for table, year in self.jobs():
+            self.load(table, year)
+
+
+    def go(self):
+        self.setup()
+        self.populatetables()
+
+
+    def __getstate__(self):
+        #cursors can't cross process boundaries; the scheduler gives each job its own
+        state = self.__dict__.copy()
+        state['cursor'] = None
+        return state
@@ -1,21 +1,91 @@
 """
 Import OpenSecrets.org's lobbying tables to MySQL
+
+Each lob_*.txt file holds every year at once. With incremental set, the files
+with a year column are fingerprinted a year at a time and only the years that
+changed are deleted and loaded again. lob_agency and lob_bills have no year;
+their rows go with the year of the lobbying report or issue they belong to,
+and are reloaded in the same job as it.
 """
 
 import MySQLdb
 import sys
+import hashlib
 import logging
 import os
 import re
 
+from crpformat import splitline
+from compact import stageencoded
+from loader import Loader, loadcrp, loadstaged, secondaryindexes, tablecolumns
+from source import RawSource, fifo
+
+
+#the field holding the year in each file that can be reloaded a year at a time
+YEAR_FIELDS = {'lobbying': 14, 'lobbyist': 4, 'lob_indus': 3, 'lob_issue': 5}
+
+#files whose rows belong to a row of another table: the parent's table, then
+#(child table, field in the child file, field in the parent file, child column, parent column)
+CHILDREN = {
+    'lobbying': ('lob_agency', 0, 0, 'uniqID', 'uniqid'),
+    'lob_issue': ('lob_bills', 1, 0, 'si_id', 'SI_ID'),
+}
+
+#the slice of child rows whose parent isn't in the parent file
+ORPHANS = '?'
+
+
+def records(infile):
+    #raw records, line endings and all, with a quoted field running over a line break kept whole
+    pending = ''
+    for line in infile:
+        pending += line
+        if pending.count('|') % 2 == 0:
+            yield pending
+            pending = ''
+    if pending:
+        yield pending
+    infile.close()
+
+
+def field(record, i):
+    fields = splitline(record)
+    if i < len(fields):
+        return fields[i]
+    return ''
+
+
+class SliceFingerprints(object):
+    """Order-independent fingerprints of a file's records, per slice: the sum of
+    the records' md5s and the count, so reordered rows don't count as a change."""
 
+    def __init__(self):
 
-class LobbyDownloader(object):
+        self.sums = {}
+
+
+    def add(self, key, record):
+        total, count = self.sums.get(key, (0, 0))
+        self.sums[key] = ((total + int(hashlib.md5(record).hexdigest(), 16)) % (1 << 128), count + 1)
+
+
+    def fingerprints(self):
+        return dict([(key, "%032x-%i" % (total, count)) for key, (total, count) in self.sums.items()])
+
+
+class LobbyDownloader(Loader):
+
+    TABLES = ['lobbying', 'lobbyist', 'lob_indus', 'lob_agency', 'lob_issue', 'lob_bills', 'lob_rpt']
+    RESOURCE = 'Lobby'
+    #reload only the years that changed
+    incremental = False
     
-    def __init__(self,cursor,path):
+    def __init__(self,cursor,path,archives=None,manifest=None):
         
         self.cursor = cursor
         self.dest_path = path
+        self.source = RawSource(path, archives, manifest)
+        self.tables = self.TABLES
 
     def createtables(self):
         queries = [
@@ -90,35 +160,144 @@ class LobbyDownloader(object):
 
 
 
-    def populatetables(self):
+    def setup(self):
+        Loader.setup(self)
+        if self.incremental:
+            #child rows are deleted through a join on these
+            for table, column in [('crp_lob_issue', 'SI_ID'), ('crp_lob_bills', 'si_id')]:
+                if 'si' not in [name for name, clause in secondaryindexes(self.cursor, table)]:
+                    self.cursor.execute("ALTER TABLE %s ADD INDEX si (%s)" % (table, column))
 
-        ext = ".txt"
-        self.cursor.execute("DELETE FROM crp_lobbying")
-        self.cursor.execute("LOAD DATA LOCAL INFILE '%s' INTO TABLE crp_%s FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '|'" % ( os.path.join(self.dest_path, "lob_lobbying" + ext)))
-        
-        self.cursor.execute("DELETE FROM crp_lobbyist")
-        self.cursor.execute("LOAD DATA LOCAL INFILE '%s' INTO TABLE crp_%s FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '|'" % ( os.path.join(self.dest_path, "lob_lobbyist" + ext)))
-        
-        self.cursor.execute("DELETE FROM crp_lob_indus")
-        self.cursor.execute("LOAD DATA LOCAL INFILE '%s' INTO TABLE crp_%s FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '|'" % ( os.path.join(self.dest_path, "lob_indus" + ext)))
-        
-        self.cursor.execute("DELETE FROM crp_lob_agency")
-        self.cursor.execute("LOAD DATA LOCAL INFILE '%s' INTO TABLE crp_%s FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '|'" % ( os.path.join(self.dest_path, "lob_agency" + ext)))
-        
-        self.cursor.execute("DELETE FROM crp_lob_issue")
-        self.cursor.execute("LOAD DATA LOCAL INFILE '%s' INTO TABLE crp_%s FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '|'" % ( os.path.join(self.dest_path, "lob_issue" + ext)))
-        
-        self.cursor.execute("DELETE FROM crp_lob_bills")
-        self.cursor.execute("LOAD DATA LOCAL INFILE '%s' INTO TABLE crp_%s FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '|'" % ( os.path.join(self.dest_path, "lob_bills" + ext)))
-        
-        self.cursor.execute("DELETE FROM crp_lob_rpt")
-        self.cursor.execute("LOAD DATA LOCAL INFILE '%s' INTO TABLE crp_%s FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '|'" % ( os.path.join(self.dest_path, "lob_rpt" + ext)))
 
+    def jobs(self):
+        #the lobbying files cover every year at once
+        tables = self.tables
+        if self.incremental:
+            #children are reloaded along with their parents
+            children = [CHILDREN[table][0] for table in tables if table in CHILDREN]
+            tables = [table for table in tables if table not in children]
+        return [(table, None) for table in tables]
 
-    def go(self):
-        self.createtables()
-        self.populatetables()
-        
+
+    def sourcefile(self, table, year):
+        if self.incremental and table in CHILDREN:
+            #the child's file matters too, so the job always runs; unchanged years are skipped in loadslices
+            return None
+        return self.filename(table)
+
+
+    def filename(self, table):
+        return "lob_" + table.replace("lob_", "") + ".txt"
+
+
+    def lastslices(self, table):
+        #fingerprints of the years loaded last time; the whole file's fingerprint is under ''
+        self.cursor.execute("SELECT cycle, fingerprint FROM crp_loads WHERE tablename=%s AND cycle<>''", (table,))
+        return dict([(cycle != '-' and cycle or '', fingerprint) for cycle, fingerprint in self.cursor.fetchall()])
+
+
+    def saveslices(self, table, fingerprints, changed):
+        for key in changed:
+            cycle = key or '-'
+            if key in fingerprints:
+                self.cursor.execute("REPLACE INTO crp_loads VALUES (%s, %s, %s, NOW())", (table, cycle, fingerprints[key]))
+            else:
+                self.cursor.execute("DELETE FROM crp_loads WHERE tablename=%s AND cycle=%s", (table, cycle))
+
+
+    def changedslices(self, table, fingerprints):
+        last = self.lastslices(table)
+        return set([key for key in set(fingerprints) | set(last) if fingerprints.get(key) != last.get(key)])
+
+
+    def loadrecords(self, table, wanted):
+        #loads the records of table's file that wanted(record) picks out
+        encoder = None
+        if self.compact:
+            cols = tablecolumns(self.cursor, "crp_" + table)
+            encoder = self.encoder(table, cols)
+        def feed(outfile):
+            picked = (record for record in records(self.source.open(self.filename(table), 'rb')) if wanted(record))
+            if not encoder:
+                outfile.writelines(picked)
+                return
+            #parsed by crpformat.readbatches, so the codes can be encoded
+            stageencoded(picked, outfile, encoder, len(cols), self.quarantine)
+        try:
+            with fifo(feed) as path:
+                if encoder:
+                    self.progress.add(rows=loadstaged(self.cursor, path, "crp_" + table, cols, quarantine=self.quarantine))
+                else:
+                    self.progress.add(rows=loadcrp(self.cursor, path, "crp_" + table, quarantine=self.quarantine))
+        finally:
+            if encoder:
+                encoder.close()
+
+
+    def loadslices(self, table):
+        """Replaces the years of table that changed since the last load, and the
+        rows of its child table that belong to them."""
+        year_field = YEAR_FIELDS[table]
+        child = CHILDREN.get(table)
+        if self.force or not self.lastslices(table):
+            #no years to go by: start from empty tables, which may hold years the file no longer has
+            for emptied in [table] + (child and [child[0]] or []):
+                self.cursor.execute("DELETE FROM crp_" + emptied)
+                self.cursor.execute("DELETE FROM crp_loads WHERE tablename=%s AND cycle<>''", (emptied,))
+
+        parents = {}
+        years = {}
+        sliced = SliceFingerprints()
+        for record in records(self.source.open(self.filename(table), 'rb')):
+            year = field(record, year_field)
+            #one copy of each year string, however many parents point at it
+            year = years.setdefault(year, year)
+            sliced.add(year, record)
+            if child:
+                parents[field(record, child[2])] = year
+        fingerprints = sliced.fingerprints()
+        changed = self.changedslices(table, fingerprints)
+
+        if child:
+            child_table, child_field, parent_field, child_column, parent_column = child
+            child_sliced = SliceFingerprints()
+            for record in records(self.source.open(self.filename(child_table), 'rb')):
+                child_sliced.add(parents.get(field(record, child_field), ORPHANS), record)
+            child_fingerprints = child_sliced.fingerprints()
+            child_changed = self.changedslices(child_table, child_fingerprints) | changed
+            child_years = child_changed - set([ORPHANS])
+            if child_years:
+                #by the parents' years as loaded, before they're replaced
+                self.cursor.execute("DELETE c FROM crp_%s c JOIN crp_%s p ON p.%s = c.%s WHERE p.year IN (%s)"
+                    % (child_table, table, parent_column, child_column, ','.join(['%s'] * len(child_years))), tuple(child_years))
+
+        logging.info("Reloading %s for %s" % (table, ', '.join(sorted(changed)) or 'no years'))
+        if changed:
+            self.cursor.execute("DELETE FROM crp_%s WHERE year IN (%s)" % (table, ','.join(['%s'] * len(changed))), tuple(changed))
+            self.loadrecords(table, lambda record: field(record, year_field) in changed)
+
+        if child:
+            if ORPHANS in child_changed:
+                self.cursor.execute("DELETE c FROM crp_%s c LEFT JOIN crp_%s p ON p.%s = c.%s WHERE p.%s IS NULL"
+                    % (child_table, table, parent_column, child_column, parent_column))
+            if child_changed:
+                self.loadrecords(child_table, lambda record: parents.get(field(record, child_field), ORPHANS) in child_changed)
+            self.saveslices(child_table, child_fingerprints, child_changed)
+        self.saveslices(table, fingerprints, changed)
+
+
+    def loadtable(self, table, years):
+        if self.incremental and table in YEAR_FIELDS:
+            self.loadslices(table)
+        else:
+            Loader.loadtable(self, table, years)
 
 
-  
+    def fill(self, table, year):
+        name = self.filename(table)
+        logging.info("Loading " + name)
+        if self.compact and table == 'lobbying':
+            self.loadencoded(name, table, tablecolumns(self.cursor, "crp_" + table))
+            return
+        with self.source.localpath(name) as src:
+            self.progress.add(rows=loadcrp(self.cursor, src, self.target("crp_" + table), quarantine=self.quarantine))
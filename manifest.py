@@ -0,0 +1,74 @@
+"""
+Keeps track of what has been downloaded: the scraped details and md5 of each
+bulk file, and a fingerprint of every text file extracted from it.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import zipfile
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def md5file(path):
+    md5 = hashlib.md5()
+    infile = open(path, 'rb')
+    for chunk in iter(lambda: infile.read(CHUNK_SIZE), ''):
+        md5.update(chunk)
+    infile.close()
+    return md5.hexdigest()
+
+
+def zipfingerprint(info):
+    return "crc:%08x:%i" % (info.CRC & 0xffffffff, info.file_size)
+
+
+def memberfingerprints(file_path, md5=None):
+    """Fingerprints of the files a download expands to, keyed by lowercased name.
+    Zip members use the CRC and size from the zip's directory, so nothing has to
+    be decompressed; anything else is its own single member."""
+    if zipfile.is_zipfile(file_path):
+        members = {}
+        for info in zipfile.ZipFile(file_path).infolist():
+            members[os.path.basename(info.filename).lower()] = zipfingerprint(info)
+        return members
+    return {os.path.basename(file_path).lower(): "md5:" + (md5 or md5file(file_path))}
+
+
+class Manifest(object):
+
+    def __init__(self,path):
+
+        self.path = path
+        self.files = {}
+        self.members = {}
+        if os.path.exists(path):
+            data = json.load(open(path))
+            self.files = data.get('files', {})
+            self.members = data.get('members', {})
+        else:
+            logging.info("no existing manifest at %s" % path)
+
+
+    def get(self, url):
+        return self.files.get(url)
+
+
+    def update(self, res, file_path):
+        self.files[res['url']] = res
+        self.members.update(memberfingerprints(file_path, res.get('md5')))
+
+
+    def fingerprint(self, name):
+        return self.members.get(name.lower())
+
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        outfile = open(tmp_path, 'w')
+        json.dump({'files': self.files, 'members': self.members}, outfile, indent=1, sort_keys=True)
+        outfile.close()
+        os.rename(tmp_path, self.path)
@@ -0,0 +1,171 @@
+"""
+Per-stage instrumentation. Each stage of a run (scrape, download, extract,
+parse, load, index) reports the bytes and rows it has moved, the rows it
+rejected, its rate and, where the total is known, an ETA, to whichever sinks
+are attached.
+"""
+
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+#seconds between progress events from a running stage
+PROGRESS_INTERVAL = 10
+
+
+class Stage(object):
+
+    def __init__(self,metrics,stage,name,total=None):
+
+        self.metrics = metrics
+        self.stage = stage
+        self.name = name
+        #expected bytes, for the ETA
+        self.total = total
+        self.rows = 0
+        self.bytes = 0
+        self.rejects = 0
+        self.start = time.time()
+        self.last = self.start
+
+
+    def add(self, rows=0, bytes=0, rejects=0):
+        self.rows += rows
+        self.bytes += bytes
+        self.rejects += rejects
+        now = time.time()
+        if now - self.last >= PROGRESS_INTERVAL:
+            self.last = now
+            self.metrics.emit(self.event('progress', now))
+
+
+    def event(self, status, now=None):
+        elapsed = (now or time.time()) - self.start
+        event = {
+            'stage': self.stage,
+            'name': self.name,
+            'status': status,
+            'pid': os.getpid(),
+            'time': time.time(),
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'rejects': self.rejects,
+            'elapsed': round(elapsed, 3),
+            'rows_per_sec': round(self.rows / max(elapsed, 0.001), 1),
+            'bytes_per_sec': round(self.bytes / max(elapsed, 0.001), 1),
+            'eta': None,
+        }
+        if status == 'done':
+            event['eta'] = 0
+        elif self.total and self.bytes:
+            event['eta'] = round(elapsed * (self.total - self.bytes) / self.bytes, 1)
+        return event
+
+
+class JSONLinesSink(object):
+    """Appends each event to path as a line of JSON."""
+
+    def __init__(self,path):
+
+        self.path = path
+
+
+    def emit(self, event):
+        #a single O_APPEND write per event, so lines from other workers never interleave
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        try:
+            os.write(fd, json.dumps(event, sort_keys=True) + '\n')
+        finally:
+            os.close(fd)
+
+
+class PrometheusSink(object):
+    """Keeps path current in Prometheus' text format, for node_exporter's textfile
+    collector: one gauge series per stage and name, holding its latest figures.
+    Workers in other processes merge their series into the file under a lock."""
+
+    FIELDS = ['rows', 'bytes', 'rejects', 'elapsed', 'rows_per_sec', 'bytes_per_sec', 'eta']
+
+    def __init__(self,path):
+
+        self.path = path
+
+
+    def emit(self, event):
+        labels = 'stage="%s",name="%s"' % (event['stage'], event['name'].replace('\\', '\\\\').replace('"', '\\"'))
+        lock = open(self.path + '.lock', 'a')
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            series = {}
+            if os.path.exists(self.path):
+                for line in open(self.path):
+                    if line.startswith('crp_'):
+                        key, value = line.rsplit(' ', 1)
+                        series[key] = value.strip()
+            for field in self.FIELDS:
+                if event[field] is not None:
+                    series['crp_stage_%s{%s}' % (field, labels)] = repr(float(event[field]))
+            series['crp_stage_done{%s}' % labels] = event['status'] == 'done' and '1' or '0'
+
+            tmp_path = self.path + '.tmp'
+            outfile = open(tmp_path, 'w')
+            metric = None
+            for key in sorted(series):
+                if key.split('{')[0] != metric:
+                    metric = key.split('{')[0]
+                    outfile.write('# TYPE %s gauge\n' % metric)
+                outfile.write('%s %s\n' % (key, series[key]))
+            outfile.close()
+            os.rename(tmp_path, self.path)
+        finally:
+            lock.close()
+
+
+def sink(path):
+    #Prometheus for a .prom file, JSON lines for anything else
+    if path.endswith('.prom'):
+        return PrometheusSink(path)
+    return JSONLinesSink(path)
+
+
+class Metrics(object):
+
+    def __init__(self):
+
+        self.sinks = []
+
+
+    def emit(self, event):
+        for sink in self.sinks:
+            try:
+                sink.emit(event)
+            except (IOError, OSError), e:
+                logging.warning("Couldn't write metrics to %s: %s" % (sink.path, e))
+
+
+    @contextmanager
+    def stage(self, stage, name, total=None):
+        """Yields a Stage to add(rows=, bytes=) to as work is done; a final event
+        is sent when the block exits, marked failed if it raised."""
+        current = Stage(self, stage, name, total)
+        try:
+            yield current
+        except:
+            self.emit(current.event('failed'))
+            raise
+        event = current.event('done')
+        logging.info("%s %s: %i rows, %i bytes in %.1fs (%.0f rows/s)" % (stage, name, event['rows'], event['bytes'], event['elapsed'], event['rows_per_sec']))
+        self.emit(event)
+
+
+#shared by every module; download.py attaches the sinks
+metrics = Metrics()
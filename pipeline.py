@@ -0,0 +1,108 @@
+"""
+Download and load at the same time. Each load job starts as soon as the
+bulk file it reads from has arrived, while the rest are still downloading,
+so a run takes about as long as its slowest stage rather than all of them
+end to end.
+
+The unit is a whole download: a zip can't be read until its directory at
+the end has arrived. From there the members are streamed out of the zip
+into LOAD DATA without being extracted (see source.py). A download that
+fails holds back only the jobs that read from it.
+"""
+
+import logging
+import Queue
+import sys
+import threading
+
+
+#downloaded files waiting to be loaded; while it's full no new download starts
+QUEUE_SIZE = 2
+
+
+class Pipeline(object):
+
+    def __init__(self,downloader,scheduler,queue_size=QUEUE_SIZE):
+
+        self.downloader = downloader
+        self.scheduler = scheduler
+        self.queue_size = queue_size
+
+
+    def run(self, loaders, resources, sections, redownload=False):
+        pending = self.downloader.pending(resources, sections, redownload)
+        waiting_for = set([res['filename'] for res in pending])
+        failed = set()
+        arrived = Queue.Queue(self.queue_size)
+        errors = []
+
+        def download():
+            try:
+                #downloads are only started while there is room for them to land
+                for res in self.downloader.downloads(pending, max(self.downloader.workers, 1)):
+                    arrived.put(res)
+            except:
+                errors.append(sys.exc_info())
+            arrived.put(None)
+
+        def jobs():
+            waiting = self.scheduler.jobs(loaders)
+            while True:
+                for job in list(waiting):
+                    needs = self.needs(job)
+                    if needs & failed:
+                        #leave the tables as they are; the other jobs go ahead
+                        waiting.remove(job)
+                        self.skip(job, needs & failed)
+                        continue
+                    if needs & waiting_for:
+                        continue
+                    waiting.remove(job)
+                    yield job
+                if not waiting_for:
+                    break
+                res = arrived.get()
+                if res is None:
+                    break
+                waiting_for.discard(res['filename'])
+                if res.get('error'):
+                    failed.add(res['filename'])
+                    continue
+                logging.info("%s.%s has arrived" % (res['filename'], res['ext']))
+                for loader in loaders:
+                    loader.source.refresh()
+            for job in waiting:
+                #the downloads stopped before these arrived
+                self.skip(job, self.needs(job))
+
+        #load worker processes are forked before the download thread starts, so
+        #none inherits a lock that thread holds
+        pool = self.scheduler.pool()
+        downloader = threading.Thread(target=download)
+        downloader.daemon = True
+        downloader.start()
+        try:
+            self.scheduler.run(loaders, jobs(), pool)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        downloader.join()
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        if failed:
+            raise IOError("failed to download %s; the tables loaded from them were left as they are" % ', '.join(sorted(failed)))
+
+
+    def skip(self, job, missing):
+        loader, table, year = job
+        if isinstance(year, tuple):
+            year = ','.join(year)
+        logging.warning("Not loading %s%s, %s didn't download" % (table, year or '', ', '.join(sorted(missing))))
+
+
+    def needs(self, job):
+        #the downloads a (loader, table, year) job reads from
+        loader, table, year = job
+        years = isinstance(year, tuple) and list(year) or [year]
+        return set([loader.resource(table, year) for year in years]) - set([None])
@@ -0,0 +1,93 @@
+"""
+Rows that can't be loaded are set aside rather than printed: each goes into
+a <job>.rejects file under the rejects directory, in CRP's own pipe-quoted
+format behind a short reason code (width for a row with the wrong number of
+fields, mysqlNNNN for a MySQL error number), and is counted. LOAD DATA
+LOCAL can't refuse a row, only drop or change it with a warning, so each
+warning it leaves is recorded the same way, with MySQL's message in place of
+the row. The file is appended to, so the rejects of an earlier run, or of the
+load a resumed one carries on, are kept. A job that rejects more than its limit is stopped,
+since by then the file is probably not in the format expected.
+"""
+
+import logging
+import os
+
+
+REJECTS_PATH = 'rejects'
+MAX_REJECTS = 1000
+
+
+class TooManyRejects(Exception):
+    pass
+
+
+def reasoncode(e):
+    #MySQLdb errors carry the server's error number, e.g. mysql1366 for a bad value
+    if e.args and isinstance(e.args[0], (int, long)):
+        return "mysql%i" % e.args[0]
+    return e.__class__.__name__
+
+
+def bywidth(rows, width):
+    """Splits rows into those with width fields and those without."""
+    good = []
+    bad = []
+    for row in rows:
+        if len(row) == width:
+            good.append(row)
+        else:
+            bad.append(row)
+    return good, bad
+
+
+class Quarantine(object):
+
+    def __init__(self,name,path=REJECTS_PATH,limit=MAX_REJECTS,stage=None):
+
+        self.name = name
+        self.path = path
+        #0 for no limit
+        self.limit = limit
+        self.stage = stage
+        self.outfile = None
+        self.count = 0
+        self.reasons = {}
+
+
+    def reject(self, row, reason):
+        self.record(reason, row)
+
+
+    def warned(self, warnings, count=None):
+        """Records the warnings a LOAD DATA left, as (code, message), in place of
+        the rows MySQL dropped or changed. count is how many there were, since
+        the server only lists the first max_error_count of them."""
+        for code, message in warnings:
+            self.record("mysql%i" % code, [message])
+        hidden = (count or len(warnings)) - len(warnings)
+        if hidden > 0:
+            self.record('mysql', ["%i more warnings not listed by the server" % hidden], hidden)
+
+
+    def record(self, reason, row, count=1):
+        if self.outfile is None:
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+            self.outfile = open(os.path.join(self.path, self.name + '.rejects'), 'a')
+        self.outfile.write(reason + ',' + ','.join(['|%s|' % f for f in row]) + '\n')
+        self.count += count
+        self.reasons[reason] = self.reasons.get(reason, 0) + count
+        if self.stage:
+            self.stage.add(rejects=count)
+        if self.limit and self.count > self.limit:
+            self.close()
+            raise TooManyRejects("%s: more than %i rows rejected, see %s" % (self.name, self.limit, self.outfile.name))
+
+
+    def close(self):
+        if self.outfile is None or self.outfile.closed:
+            return
+        self.outfile.close()
+        logging.warning("%s: rejected %i rows (%s), see %s" % (self.name, self.count,
+            ', '.join(["%s %i" % item for item in sorted(self.reasons.items())]), self.outfile.name))
@@ -0,0 +1,90 @@
+"""
+Run the (section, table, cycle) load jobs of several downloaders side by side.
+
+Each job gets its own MySQL connection, so with more than one worker the
+server can work on several LOAD DATA statements at once.
+"""
+
+import copy
+import logging
+import time
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from indexes import buildindexes, INDEX_PROFILES
+from loader import connect
+
+
+def runjob(job):
+    loader, table, year = job
+    start = time.time()
+    db = connect()
+    try:
+        loader = copy.copy(loader)
+        loader.cursor = db.cursor()
+        loader.load(table, year)
+        db.commit()
+    finally:
+        db.close()
+    return (loader.__class__.__name__, table, year, time.time() - start)
+
+
+class LoadScheduler(object):
+
+    def __init__(self,workers=1,processes=True,index_profile='minimal'):
+
+        self.workers = workers
+        self.processes = processes
+        self.index_profile = index_profile
+        if index_profile not in INDEX_PROFILES:
+            #fail now rather than after the load
+            raise ValueError("Unknown index profile %s, use one of %s" % (index_profile, ', '.join(sorted(INDEX_PROFILES))))
+
+
+    def jobs(self, loaders):
+        return [(loader, table, year) for loader in loaders for (table, year) in loader.jobs()]
+
+
+    def pool(self):
+        #the pool runpool hands jobs to, or None to run them here
+        if self.workers <= 1:
+            return None
+        if self.processes:
+            return Pool(self.workers)
+        return ThreadPool(self.workers)
+
+
+    def run(self, loaders, jobs=None, pool=None):
+        """Runs the loaders' jobs, or the jobs given, which can be a generator that
+        hands them out as they become ready. pool is one made by pool() ahead of
+        time, e.g. before any other threads are started."""
+        #tables are created up front, on the loaders' own cursor
+        for loader in loaders:
+            loader.setup()
+
+        if jobs is None:
+            jobs = self.jobs(loaders)
+        if self.workers <= 1:
+            for loader, table, year in jobs:
+                loader.load(table, year)
+        else:
+            self.runpool(jobs, pool)
+
+        #extra indexes go on once all the rows are in, on connections of their own;
+        #commit first so the loaders' open transaction doesn't hold their tables
+        for cursor in set([loader.cursor for loader in loaders]):
+            cursor.connection.commit()
+        buildindexes(self.index_profile)
+
+
+    def runpool(self, jobs, pool=None):
+        pool = pool or self.pool()
+        logging.info("Running load jobs on %i workers" % self.workers)
+        try:
+            for name, table, year, elapsed in pool.imap_unordered(runjob, jobs):
+                if isinstance(year, tuple):
+                    year = ','.join(year)
+                logging.info("%s loaded %s%s in %.1fs" % (name, table, year or '', elapsed))
+        finally:
+            pool.close()
+            pool.join()
@@ -0,0 +1,145 @@
+"""
+Where the loaders read CRP's text files from: extracted into DEST_PATH, or
+still inside the downloaded zips, streamed out without touching disk.
+"""
+
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import zipfile
+from contextlib import contextmanager
+
+from manifest import md5file, zipfingerprint
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+@contextmanager
+def fifo(feed):
+    """Yields the path of a named pipe that a background thread fills by calling
+    feed(outfile). LOAD DATA LOCAL INFILE reads it like any other file."""
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'pipe')
+
+    if not hasattr(os, 'mkfifo'):
+        #no named pipes on Windows, fall back to a scratch file
+        outfile = open(path, 'wb')
+        try:
+            feed(outfile)
+        finally:
+            outfile.close()
+        try:
+            yield path
+        finally:
+            shutil.rmtree(tmpdir)
+        return
+
+    os.mkfifo(path)
+    errors = []
+    def run():
+        try:
+            outfile = open(path, 'wb')
+            try:
+                feed(outfile)
+            finally:
+                outfile.close()
+        except:
+            errors.append(sys.exc_info())
+    writer = threading.Thread(target=run)
+    writer.daemon = True
+    writer.start()
+
+    try:
+        yield path
+    finally:
+        while writer.is_alive():
+            #the reader never opened the pipe or gave up early; briefly open our own
+            #end so a blocked writer gets through open() and then fails on write
+            fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            writer.join(0.1)
+            os.close(fd)
+        shutil.rmtree(tmpdir)
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+
+class RawSource(object):
+
+    def __init__(self,dest_path,archives=None,manifest=None):
+
+        self.dest_path = dest_path
+        self.archives = archives
+        self.manifest = manifest
+        self.members = None
+
+
+    def index(self):
+        #member name -> (zip file, name inside the zip), for every zip in archives
+        if self.members is None:
+            self.members = {}
+            if self.archives:
+                for zip_path in sorted(glob.glob(os.path.join(self.archives, '*.zip'))):
+                    for info in zipfile.ZipFile(zip_path).infolist():
+                        self.members[os.path.basename(info.filename).lower()] = (zip_path, info.filename)
+        return self.members
+
+
+    def refresh(self):
+        #forget the zips seen so far, after another has been downloaded
+        self.members = None
+
+
+    def find(self, name):
+        return self.index().get(name.lower())
+
+
+    def fingerprint(self, name):
+        """Identifies the current contents of name, cheaply where possible: from the
+        zip directory, then the download manifest, hashing the file only as a last resort."""
+        member = self.find(name)
+        if member:
+            return zipfingerprint(zipfile.ZipFile(member[0]).getinfo(member[1]))
+        if self.manifest and self.manifest.fingerprint(name):
+            return self.manifest.fingerprint(name)
+        path = os.path.join(self.dest_path, name)
+        if os.path.exists(path):
+            return "md5:" + md5file(path)
+        return None
+
+
+    def filepath(self, name):
+        #name's path on disk, or None if it is only inside a zip
+        if self.find(name):
+            return None
+        return os.path.join(self.dest_path, name)
+
+
+    def open(self, name, mode='rU'):
+        """name opened for reading, mode as for open(). The loaders open in 'rb'
+        to get byte offsets; zip members are always bytes, and ZipFile.open only
+        takes r, U and rU, so the 'b' is dropped for them."""
+        member = self.find(name)
+        if member:
+            return zipfile.ZipFile(member[0]).open(member[1], mode.replace('b', ''))
+        return open(os.path.join(self.dest_path, name), mode)
+
+
+    @contextmanager
+    def localpath(self, name):
+        """A path LOAD DATA can read name from; zip members are piped through a fifo."""
+        if not self.find(name):
+            yield os.path.join(self.dest_path, name)
+            return
+
+        def feed(outfile):
+            infile = self.open(name, 'r')
+            for chunk in iter(lambda: infile.read(CHUNK_SIZE), ''):
+                outfile.write(chunk)
+            infile.close()
+
+        with fifo(feed) as path:
+            yield path
@@ -0,0 +1,112 @@
+"""
+Summary tables of the contribution and expenditure tables, totalled by
+recipient, industry code, employer and expenditure code for each cycle.
+
+They're refreshed one cycle at a time as that cycle is loaded: its rows are
+deleted and regrouped from the table just loaded, and other cycles are left
+alone. The industry and sector views join the small summary tables to
+crp_categories and crp_expendcodes when queried, so they stay right whichever
+order the sections are loaded in.
+"""
+
+import logging
+
+from metrics import metrics
+
+
+SUMMARY_TABLES = [
+    """CREATE TABLE IF NOT EXISTS crp_sum_recip(
+                Cycle char(4) NOT NULL,
+                source varchar(10) NOT NULL,
+                RecipID char(9) NULL,
+                total bigint NULL,
+                n int NOT NULL,
+                INDEX (Cycle, source),
+                INDEX (RecipID)
+                );""",
+    """CREATE TABLE IF NOT EXISTS crp_sum_realcode(
+                Cycle char(4) NOT NULL,
+                source varchar(10) NOT NULL,
+                RealCode char(5) NULL,
+                total bigint NULL,
+                n int NOT NULL,
+                INDEX (Cycle, source),
+                INDEX (RealCode)
+                );""",
+    """CREATE TABLE IF NOT EXISTS crp_sum_org(
+                Cycle char(4) NOT NULL,
+                source varchar(10) NOT NULL,
+                Orgname varchar(40) NULL,
+                UltOrg varchar(40) NULL,
+                total bigint NULL,
+                n int NOT NULL,
+                INDEX (Cycle, source),
+                INDEX (Orgname),
+                INDEX (UltOrg)
+                );""",
+    """CREATE TABLE IF NOT EXISTS crp_sum_expcode(
+                Cycle char(4) NOT NULL,
+                source varchar(10) NOT NULL,
+                ExpCode char(3) NULL,
+                total bigint NULL,
+                n int NOT NULL,
+                INDEX (Cycle, source)
+                );""",
+]
+
+#views, and the lookup table each needs before it can be created
+SUMMARY_VIEWS = [
+    ('crp_categories', """CREATE OR REPLACE VIEW crp_sum_industry AS
+                SELECT s.Cycle, s.source, c.sector, c.industry, SUM(s.total) AS total, SUM(s.n) AS n
+                FROM crp_sum_realcode s LEFT JOIN crp_categories c ON c.catcode = s.RealCode
+                GROUP BY s.Cycle, s.source, c.sector, c.industry"""),
+    ('crp_expendcodes', """CREATE OR REPLACE VIEW crp_sum_expsector AS
+                SELECT s.Cycle, e.sector, e.sectorname, SUM(s.total) AS total, SUM(s.n) AS n
+                FROM crp_sum_expcode s LEFT JOIN crp_expendcodes e ON e.expcode = s.ExpCode
+                GROUP BY s.Cycle, e.sector, e.sectorname"""),
+]
+
+#for each loaded table: the summary table and the grouped columns that fill it
+SUMMARIES = {
+    'indivs': [
+        ('crp_sum_recip', 'RecipID'),
+        ('crp_sum_realcode', 'RealCode'),
+        ('crp_sum_org', 'Orgname, UltOrg'),
+    ],
+    'pacs': [
+        ('crp_sum_recip', 'CID'),
+        ('crp_sum_realcode', 'RealCode'),
+    ],
+    'expends': [
+        ('crp_sum_expcode', 'ExpCode'),
+    ],
+}
+
+
+def createsummaries(cursor):
+    for query in SUMMARY_TABLES:
+        cursor.execute(query)
+    for lookup, query in SUMMARY_VIEWS:
+        cursor.execute("SHOW TABLES LIKE %s", (lookup,))
+        if cursor.fetchone():
+            cursor.execute(query)
+        else:
+            logging.info("No %s yet, leaving out its summary view" % lookup)
+
+
+def refresh(cursor, table, years, compact=False):
+    """Regroups table's rows for years into its summary tables; from its view
+    with the codes put back if it is in compact form."""
+    source = "crp_" + table
+    if compact:
+        source += "_codes"
+    for summary, columns in SUMMARIES.get(table, []):
+        for year in years:
+            if year is None:
+                continue
+            cycle = "20" + year
+            with metrics.stage('summarize', "%s%s" % (summary, year)) as summarized:
+                cursor.execute("DELETE FROM %s WHERE Cycle=%%s AND source=%%s" % summary, (cycle, table))
+                cursor.execute("INSERT INTO %s SELECT Cycle, %%s, %s, SUM(Amount), COUNT(*) FROM %s WHERE Cycle=%%s GROUP BY Cycle, %s"
+                    % (summary, columns, source, columns), (table, cycle))
+                summarized.add(rows=cursor.rowcount)
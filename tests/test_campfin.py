@@ -0,0 +1,61 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+import bench
+import campfin
+import crpformat
+from campfin import stageindivs, stageparallel
+
+
+class StageParallelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'indivs12.txt')
+        random.seed(2012)
+        bench.writefile(self.path, bench.indivs, '2012', 2000)
+        out = StringIO()
+        stageindivs(open(self.path, 'rb'), out)
+        self.expected = sorted(out.getvalue().splitlines())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def staged(self, path, infile=None):
+        out = StringIO()
+        count = stageparallel(path, out, 3, infile=infile)
+        self.assertEqual(count, len(self.expected))
+        return sorted(out.getvalue().splitlines())
+
+    def test_file_on_disk(self):
+        self.assertEqual(self.staged(self.path), self.expected)
+
+    def test_big_file_on_disk(self):
+        #cut into chunks of about CHUNK_SIZE, not a fixed number per worker
+        bounds = []
+        chunkbounds, chunk_size = campfin.chunkbounds, campfin.CHUNK_SIZE
+        campfin.chunkbounds = lambda path, parts: bounds.extend(chunkbounds(path, parts)) or bounds
+        campfin.CHUNK_SIZE = 20000
+        try:
+            self.assertEqual(self.staged(self.path), self.expected)
+        finally:
+            campfin.chunkbounds, campfin.CHUNK_SIZE = chunkbounds, chunk_size
+        self.assertEqual(len(bounds) - 1, os.path.getsize(self.path) / 20000)
+
+    def test_stream(self):
+        #as for a member read out of its zip, with no path to cut up; in small
+        #chunks, so there are more of them than the workers take at once
+        splitchunks = campfin.splitchunks
+        campfin.splitchunks = lambda infile: crpformat.splitchunks(infile, chunk_size=20000)
+        try:
+            self.assertEqual(self.staged(None, open(self.path, 'rb')), self.expected)
+        finally:
+            campfin.splitchunks = splitchunks
+
+
+if __name__ == '__main__':
+    unittest.main()
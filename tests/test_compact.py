@@ -0,0 +1,87 @@
+import unittest
+
+import compact
+from compact import compacted, dimensiontable
+from loader import Loader
+
+
+class StandInCursor(object):
+    """Answers SHOW COLUMNS from a dict of {table: {column: type}} and notes
+    every other statement."""
+
+    def __init__(self, types):
+        self.types = types
+        self.statements = []
+        self.result = None
+
+    def execute(self, sql, args=()):
+        if sql.startswith("SHOW COLUMNS FROM "):
+            table = sql.split()[3]
+            col = args and args[0] or sql.split("'")[1]
+            columns = self.types.get(table, {})
+            self.result = col in columns and (col, columns[col]) or None
+        else:
+            self.statements.append(sql)
+
+    def fetchone(self):
+        return self.result
+
+
+class StandInLoader(Loader):
+
+    tables = ['indivs', 'pacs', 'cmtes']
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def createtables(self):
+        pass
+
+
+class CompactedTest(unittest.TestCase):
+
+    def setUp(self):
+        #converting the tables is left out, setup's choice of mode is what's tested
+        self.compacttables = compact.compacttables
+        self.converted = []
+        compact.compacttables = lambda cursor, tables: self.converted.extend(tables)
+
+    def tearDown(self):
+        compact.compacttables = self.compacttables
+
+    def test_tables_holding_ids(self):
+        cursor = StandInCursor({
+            'crp_indivs': {'RealCode': 'smallint(5) unsigned', 'Recipcode': 'smallint(5) unsigned'},
+            'crp_pacs': {'RealCode': 'char(5)', 'Type': 'char(3)'},
+        })
+        self.assertEqual(compacted(cursor, ['indivs', 'pacs', 'cmtes']), ['indivs'])
+
+    def test_setup_turns_compact_on(self):
+        #codes loaded into smallint columns would all become 0
+        loader = StandInLoader(StandInCursor({'crp_indivs': {'RealCode': 'smallint(5) unsigned'}}))
+        loader.setup()
+        self.assertTrue(loader.compact)
+        self.assertEqual(self.converted, loader.tables)
+
+    def test_setup_leaves_char_columns(self):
+        loader = StandInLoader(StandInCursor({'crp_indivs': {'RealCode': 'char(5)'}}))
+        loader.setup()
+        self.assertFalse(loader.compact)
+        self.assertEqual(self.converted, [])
+
+
+class DimensionTableTest(unittest.TestCase):
+
+    def test_code_made_binary(self):
+        cursor = StandInCursor({'crp_dim_state': {'code': 'varchar(10)'}})
+        dimensiontable(cursor, 'state')
+        self.assertEqual(cursor.statements[-1], "ALTER TABLE crp_dim_state MODIFY code varbinary(10) NOT NULL")
+
+    def test_binary_code_left(self):
+        cursor = StandInCursor({'crp_dim_state': {'code': 'varbinary(10)'}})
+        dimensiontable(cursor, 'state')
+        self.assertFalse([sql for sql in cursor.statements if sql.startswith('ALTER')])
+
+
+if __name__ == '__main__':
+    unittest.main()
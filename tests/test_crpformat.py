@@ -0,0 +1,165 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from cStringIO import StringIO
+
+from crpformat import splitline, readbatches, chunkbounds, readchunk, splitchunks, parsechunk, readchunks
+
+
+#CRLF line endings, an iso8859-1 name, a comma and a line break inside quoted
+#fields, unquoted numbers and an empty quoted field
+SAMPLE = (
+    '|2012|,|0000001|,|SMITH, JOHN|,250,|Acme, Inc|,||\r\n'
+    '|2012|,|0000002|,|NU\xd1EZ, MAR\xcdA|,1000,|Retired|,|x|\r\n'
+    '|2012|,|0000003|,|JONES, ANN|,-500,|Two\r\nLines|,|y|\r\n'
+    '|2012|,|0000004|,|BROWN, BOB|,2300,|None|,||\r\n'
+)
+
+
+def csvrows(data):
+    #what the csv module makes of data, as the loaders did before crpformat
+    lines = data.decode('iso8859-1').encode('utf-8').replace('\r\n', '\n')
+    return [[f.strip() for f in row] for row in csv.reader(StringIO(lines), quotechar='|') if row]
+
+
+class SplitLineTest(unittest.TestCase):
+
+    def test_quoted_and_bare_fields(self):
+        self.assertEqual(splitline('|a|,1,|b, c|,,|d|'), ['a', '1', 'b, c', '', 'd'])
+
+    def test_bare_fields_only(self):
+        self.assertEqual(splitline('1, 2,3'), ['1', '2', '3'])
+
+    def test_empty_quoted_fields(self):
+        self.assertEqual(splitline('||,||'), ['', ''])
+
+
+class ReadBatchesTest(unittest.TestCase):
+
+    def rows(self, data, **kwargs):
+        return [row for batch in readbatches(StringIO(data), **kwargs) for row in batch]
+
+    def test_matches_csv(self):
+        self.assertEqual(self.rows(SAMPLE), csvrows(SAMPLE))
+
+    def test_block_boundaries(self):
+        #every block size cuts the records somewhere else, including inside quotes
+        for block_size in range(1, len(SAMPLE) + 1):
+            self.assertEqual(self.rows(SAMPLE, block_size=block_size), csvrows(SAMPLE), block_size)
+
+    def test_batch_size(self):
+        batches = list(readbatches(StringIO(SAMPLE), batch_size=3))
+        self.assertEqual([len(batch) for batch in batches], [3, 1])
+
+    def test_transcodes_to_utf8(self):
+        self.assertEqual(self.rows(SAMPLE)[1][2], u'NU\xd1EZ, MAR\xcdA'.encode('utf-8'))
+
+    def test_last_line_without_newline(self):
+        self.assertEqual(self.rows('|a|,1\r\n|b|,2'), [['a', '1'], ['b', '2']])
+
+    def test_empty_file(self):
+        self.assertEqual(list(readbatches(StringIO(''))), [])
+
+    def test_raw_records(self):
+        #an iterable of raw records, as lobby.py picks them out of a file
+        records = [line + '\r\n' for line in SAMPLE.split('\r\n')[:-1]]
+        self.assertEqual([row for batch in readbatches(iter(records)) for row in batch], csvrows(SAMPLE))
+
+
+class ChunkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'indivs12.txt')
+        outfile = open(self.path, 'wb')
+        outfile.write(SAMPLE * 50)
+        outfile.close()
+        self.expected = csvrows(SAMPLE * 50)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_chunkbounds_fall_between_records(self):
+        for parts in [1, 2, 3, 7, 40, 500]:
+            bounds = chunkbounds(self.path, parts)
+            self.assertEqual(bounds[0], 0)
+            self.assertEqual(bounds[-1], os.path.getsize(self.path))
+            self.assertEqual(bounds, sorted(set(bounds)))
+            rows = []
+            for start, end in zip(bounds, bounds[1:]):
+                rows.extend(readchunk(self.path, start, end))
+            self.assertEqual(rows, self.expected, parts)
+
+    def test_chunkbounds_empty_file(self):
+        open(self.path, 'wb').close()
+        self.assertEqual(chunkbounds(self.path, 4), [0, 0])
+
+    def test_splitchunks(self):
+        size = os.path.getsize(self.path)
+        for chunk_size in [1, 10, 64, 1000, size, size * 2]:
+            chunks = list(splitchunks(open(self.path, 'rb'), chunk_size=chunk_size))
+            self.assertEqual(chunks[-1][0], size)
+            rows = []
+            for offset, text in chunks:
+                rows.extend(parsechunk(text))
+            self.assertEqual(rows, self.expected, chunk_size)
+
+    def test_readchunks_resumes_at_offsets(self):
+        chunks = list(readchunks(open(self.path, 'rb'), chunk_size=300))
+        self.assertEqual([row for offset, rows in chunks for row in rows], self.expected)
+        done = 0
+        for offset, rows in chunks:
+            #picking up at any offset yielded gives just the rows after it
+            done += len(rows)
+            rest = [row for o, rows in readchunks(open(self.path, 'rb'), offset, None, 300) for row in rows]
+            self.assertEqual(rest, self.expected[done:], offset)
+
+    def test_readchunks_between_offsets(self):
+        chunks = list(readchunks(open(self.path, 'rb'), chunk_size=300))
+        start, end = chunks[2][0], chunks[5][0]
+        rows = [row for offset, rows in readchunks(open(self.path, 'rb'), start, end, 300) for row in rows]
+        self.assertEqual(rows, [row for offset, rows in chunks[3:6] for row in rows])
+
+    def test_splitchunks_seeks(self):
+        start = list(splitchunks(open(self.path, 'rb'), chunk_size=300))[3][0]
+        infile = ReadCounter(open(self.path, 'rb'))
+        rest = [row for offset, text in splitchunks(infile, start) for row in parsechunk(text)]
+        self.assertEqual(rest, csvrows((SAMPLE * 50)[start:]))
+        self.assertEqual(infile.read_bytes, os.path.getsize(self.path) - start)
+
+    def test_splitchunks_zip_member_read_to_start(self):
+        zip_path = os.path.join(self.tmpdir, 'indivs12.zip')
+        archive = zipfile.ZipFile(zip_path, 'w')
+        archive.write(self.path, 'indivs12.txt')
+        archive.close()
+        chunks = list(readchunks(open(self.path, 'rb'), chunk_size=300))
+        start = chunks[3][0]
+        member = zipfile.ZipFile(zip_path).open('indivs12.txt')
+        rest = [row for offset, rows in readchunks(member, start, None, 300) for row in rows]
+        self.assertEqual(rest, [row for offset, rows in chunks[4:] for row in rows])
+
+
+class ReadCounter(object):
+    #a file that counts the bytes read from it
+
+    def __init__(self, infile):
+        self.infile = infile
+        self.read_bytes = 0
+
+    def seek(self, offset):
+        self.infile.seek(offset)
+
+    def read(self, size):
+        data = self.infile.read(size)
+        self.read_bytes += len(data)
+        return data
+
+    def close(self):
+        self.infile.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from delta import DeltaState, entry, keyfits, diff, printablekey, RECORD
+
+
+def entries(rows, key_field=None):
+    return sorted([entry(row, key_field) for row in rows])
+
+
+class EntryTest(unittest.TestCase):
+
+    def test_size(self):
+        self.assertEqual(len(entry(['2012', '0000001', 'a'], 1)), RECORD)
+        self.assertEqual(len(entry(['2012', '0000001', 'a'])), RECORD)
+
+    def test_keyed_on_field(self):
+        e = entry(['2012', '0000001', 'a'], 1)
+        self.assertEqual(printablekey(e[:8], 1), '0000001')
+        self.assertNotEqual(e, entry(['2012', '0000001', 'b'], 1))
+        self.assertEqual(e[:8], entry(['2012', '0000001', 'b'], 1)[:8])
+
+    def test_keyed_on_hash(self):
+        e = entry(['2012', 'a'])
+        self.assertEqual(e[:8], e[8:])
+        self.assertEqual(printablekey(e[:8]), e[:8].encode('hex'))
+
+    def test_long_key(self):
+        row = ['2012', '123456789', 'a']
+        self.assertFalse(keyfits(row, 1))
+        self.assertTrue(keyfits(row))
+        self.assertRaises(ValueError, entry, row, 1)
+        self.assertTrue(keyfits(['2012', '12345678', 'a'], 1))
+
+
+class DiffTest(unittest.TestCase):
+
+    def test_changes(self):
+        old = [['1', 'a'], ['2', 'b'], ['3', 'c']]
+        new = [['1', 'a'], ['2', 'B'], ['4', 'd']]
+        deleted, inserted = diff(''.join(entries(old, 0)), entries(new, 0))
+        self.assertEqual(sorted([printablekey(e[:8], 0) for e in deleted]), ['2', '3'])
+        self.assertEqual(sorted([printablekey(e[:8], 0) for e in inserted]), ['2', '4'])
+
+    def test_no_earlier_load(self):
+        new = entries([['a'], ['b']])
+        self.assertEqual(diff('', new), ([], new))
+
+    def test_unchanged(self):
+        rows = [['a'], ['b'], ['c']]
+        self.assertEqual(diff(''.join(entries(rows)), entries(rows)), ([], []))
+
+    def test_repeats_matched_one_for_one(self):
+        old = entries([['a'], ['a'], ['b']])
+        new = entries([['a'], ['b'], ['b']])
+        deleted, inserted = diff(''.join(old), new)
+        self.assertEqual(deleted, entries([['a']]))
+        self.assertEqual(inserted, entries([['b']]))
+
+    def test_everything_deleted(self):
+        old = entries([['a'], ['b']])
+        self.assertEqual(diff(''.join(old), []), (old, []))
+
+
+class DeltaStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        state = DeltaState(os.path.join(self.tmpdir, 'state', 'indivs12'))
+        self.assertEqual(state.load(), (None, ''))
+        new = entries([['2012', '0000001', 'a'], ['2012', '0000002', 'b']], 1)
+        state.save('md5:abc', new)
+        self.assertEqual(state.load(), ('md5:abc', ''.join(new)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import bench
+from campfin import CampFinDownloader
+from donors import DonorIndex, DonorIndexBuilder, keyhash, namekey
+
+
+def keys(transid, lastname, first, zipcode, contribid):
+    return transid, keyhash(namekey(lastname, first, zipcode)), keyhash(contribid)
+
+
+class DonorIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'donors', 'indivs12.donors')
+        builder = DonorIndexBuilder()
+        builder.add([
+            keys('0000003', 'SMITH', 'JOHN', '22201', 'h0000000001'),
+            keys('0000001', 'SMITH', 'JOHNATHAN', '22201', 'h0000000002'),
+            keys('0000002', 'JONES', 'MARY', '10021', 'h0000000001'),
+        ])
+        #ids longer than 8 bytes, the first two sharing their first 8
+        builder.add([
+            keys('4041220120001', 'BROWN', 'BOB', '90049', ''),
+            keys('4041220120002', 'BROWN', 'BOBBY', '90049', 'h0000000003'),
+            keys('4041220130001', 'NGUYEN', 'ANH', '77002', 'h0000000003'),
+        ])
+        builder.save(self.path)
+        self.index = DonorIndex(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_byname(self):
+        self.assertEqual(sorted(self.index.byname('smith', 'Johnny', '22201-1234')), ['0000001', '0000003'])
+        self.assertEqual(self.index.byname('SMITH', 'JOHN', '99999'), [])
+
+    def test_byfamily(self):
+        self.assertEqual(sorted(self.index.byfamily('h0000000001')), ['0000002', '0000003'])
+        #the family part is the first 11 characters of ContribID
+        self.assertEqual(sorted(self.index.byfamily('h00000000031')), ['4041220120002', '4041220130001'])
+
+    def test_cluster(self):
+        self.assertEqual(self.index.cluster('0000003'), ['0000001', '0000002', '0000003'])
+        self.assertEqual(self.index.cluster('4041220120001'), ['4041220120001', '4041220120002'])
+        self.assertEqual(self.index.cluster('4041220120002'), ['4041220120001', '4041220120002', '4041220130001'])
+
+    def test_whole_ids(self):
+        self.assertNotEqual(self.index.row('4041220120001'), self.index.row('4041220120002'))
+        self.assertEqual(self.index.row('40412201'), None)
+        self.assertEqual(self.index.row('40412201200010'), None)
+        self.assertEqual(self.index.cluster('missing'), [])
+
+    def test_empty(self):
+        DonorIndexBuilder().save(self.path)
+        index = DonorIndex(self.path)
+        self.assertEqual(index.count, 0)
+        self.assertEqual(index.cluster('0000001'), [])
+
+
+class DonorsLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        random.seed(2012)
+        bench.writefile(os.path.join(self.tmpdir, 'indivs12.txt'), bench.indivs, '2012', 500)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_load_writes_index(self):
+        #what --donors does for an indivs load, with rows going to a stand-in cursor
+        loader = CampFinDownloader(bench.StandInCursor(), self.tmpdir, ['12'], tables=['indivs'])
+        loader.donors = True
+        loader.donor_path = os.path.join(self.tmpdir, 'donors')
+        loader.rejects_path = os.path.join(self.tmpdir, 'rejects')
+        for table, year in loader.jobs():
+            loader.load(table, year)
+        index = DonorIndex(os.path.join(self.tmpdir, 'donors', 'indivs12.donors'))
+        self.assertEqual(index.count, 500)
+        self.assertTrue('0000042' in index.cluster('0000042'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import BaseHTTPServer
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib2
+
+from extras import ExtrasDownloader
+from httpcache import HTTPCache
+
+
+ROW = '<td><a href="/pacs/lookup2.php?strID=%s">%s</a> </td>\n<td> <a href="/politicians/summary.php?cid=%s">Candidate</a></td>\n'
+
+#a lead PAC listed twice, a second PAC for the same candidate, and a row without a candidate
+LEADPACS = ''.join([
+    ROW % ('C00000001', 'Leadership Fund', 'N00000001'),
+    ROW % ('C00000001', 'Leadership Fund', 'N00000001'),
+    ROW % ('C00000002', 'Another Lead PAC', 'N00000001'),
+    ROW % ('C00000003', 'Third Lead PAC', 'N00000002'),
+    '<td><a href="/pacs/lookup2.php?strID=C00000004">Unlinked PAC</a> </td>\n<td>none</td>\n',
+])
+
+
+class FixtureHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the server's pages, with an ETag and a Last-Modified for each,
+    answering a conditional request for an unchanged page with a 304."""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, self.headers.get('If-None-Match'), self.headers.get('If-Modified-Since')))
+        body = server.pages.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        etag = '"%i"' % hash(body)
+        modified = self.headers.get('If-Modified-Since') == server.modified and server.use_last_modified
+        if self.headers.get('If-None-Match') == etag or modified:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if not server.use_last_modified:
+            self.send_header('ETag', etag)
+        self.send_header('Last-Modified', server.modified)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FixtureServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), FixtureHandler)
+        self.server.pages = {}
+        self.server.requests = []
+        self.server.modified = 'Mon, 01 Oct 2012 00:00:00 GMT'
+        self.server.use_last_modified = False
+        self.base_url = 'http://127.0.0.1:%i' % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+
+class HTTPCacheTest(FixtureServerTest):
+
+    def setUp(self):
+        FixtureServerTest.setUp(self)
+        self.server.pages['/page'] = 'first'
+        self.url = self.base_url + '/page'
+
+    def test_fresh_page_served_from_disk(self):
+        cache = HTTPCache(self.tmpdir)
+        self.assertEqual(cache.get(self.url), 'first')
+        self.server.pages['/page'] = 'second'
+        self.assertEqual(cache.get(self.url), 'first')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_revalidated_with_etag(self):
+        cache = HTTPCache(self.tmpdir, max_age=0)
+        self.assertEqual(cache.get(self.url), 'first')
+        self.assertEqual(cache.get(self.url), 'first')
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[1][1], '"%i"' % hash('first'))
+
+    def test_changed_page_fetched_again(self):
+        cache = HTTPCache(self.tmpdir, max_age=0)
+        cache.get(self.url)
+        self.server.pages['/page'] = 'second'
+        self.assertEqual(cache.get(self.url), 'second')
+        self.assertEqual(cache.get(self.url), 'second')
+
+    def test_revalidated_with_last_modified(self):
+        self.server.use_last_modified = True
+        cache = HTTPCache(self.tmpdir, max_age=0)
+        self.assertEqual(cache.get(self.url), 'first')
+        self.server.pages['/page'] = 'changed, but not by date'
+        self.assertEqual(cache.get(self.url), 'first')
+        self.assertEqual(self.server.requests[1][2], self.server.modified)
+
+    def test_missing_page(self):
+        cache = HTTPCache(self.tmpdir)
+        self.assertRaises(urllib2.HTTPError, cache.get, self.base_url + '/missing')
+
+
+class LeadPACsTest(FixtureServerTest):
+
+    def test_leadpacs(self):
+        self.server.pages['/pacs/industry.php?txt=Q03&cycle=2012'] = LEADPACS
+        extras = ExtrasDownloader(None, self.tmpdir, ['12'], base_url=self.base_url)
+        extras.scrape(['12'])
+        self.assertEqual(extras.leadpacs('12'), [
+            ['2012', 'N00000001', 'C00000001'],
+            ['2012', 'N00000001', 'C00000002'],
+            ['2012', 'N00000002', 'C00000003'],
+        ])
+        #the load job reads the page scraped in setup from the cache
+        self.assertEqual(len(self.server.requests), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
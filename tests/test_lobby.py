@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+from lobby import LobbyDownloader, SliceFingerprints, records
+
+
+#SI_ID, uniqID, issueID, issue, SpecificIssue, year; the third has no year
+ISSUES = [
+    '|1|,|u1|,|TAX|,|Taxes|,|Two\r\nLines|,|2011|\r\n',
+    '|2|,|u2|,|BUD|,|Budget|,|Spending|,|2012|\r\n',
+    '|3|,|u3|,|DEF|,|Defense|,|Bases|,||\r\n',
+]
+
+#B_ID, si_id, CongNo, Bill_Name; the last belongs to no issue
+BILLS = [
+    '|10|,|1|,|112|,|H.R.1|\r\n',
+    '|11|,|2|,|112|,|S.2|\r\n',
+    '|12|,|3|,|112|,|H.R.3|\r\n',
+    '|13|,|99|,|112|,|H.R.99|\r\n',
+]
+
+
+class RecordsTest(unittest.TestCase):
+
+    def test_quoted_line_break_kept_whole(self):
+        self.assertEqual(list(records(StringIO(''.join(ISSUES)))), ISSUES)
+
+    def test_last_record_without_newline(self):
+        self.assertEqual(list(records(StringIO('|a|,1\r\n|b|,2'))), ['|a|,1\r\n', '|b|,2'])
+
+
+class SliceFingerprintsTest(unittest.TestCase):
+
+    def fingerprints(self, rows):
+        sliced = SliceFingerprints()
+        for key, record in rows:
+            sliced.add(key, record)
+        return sliced.fingerprints()
+
+    def test_order_independent(self):
+        rows = [('2012', record) for record in BILLS]
+        self.assertEqual(self.fingerprints(rows), self.fingerprints(list(reversed(rows))))
+
+    def test_changed_record(self):
+        rows = [('2011', BILLS[0]), ('2012', BILLS[1])]
+        before = self.fingerprints(rows)
+        after = self.fingerprints([('2011', BILLS[0]), ('2012', BILLS[2])])
+        self.assertEqual(before['2011'], after['2011'])
+        self.assertNotEqual(before['2012'], after['2012'])
+
+    def test_duplicate_record_counted(self):
+        #the sum alone can't tell a doubled row from a changed one, the count can
+        self.assertNotEqual(self.fingerprints([('2012', BILLS[0])]), self.fingerprints([('2012', BILLS[0])] * 2))
+
+
+class StandInCursor(object):
+    """Keeps crp_loads in a dict and notes every other statement."""
+
+    def __init__(self):
+        self.loads = {}
+        self.statements = []
+        self.result = []
+
+    def execute(self, sql, args=()):
+        if sql.startswith("SELECT cycle, fingerprint FROM crp_loads"):
+            self.result = [(cycle, fingerprint) for (table, cycle), fingerprint in self.loads.items() if table == args[0] and cycle != '']
+        elif sql.startswith("REPLACE INTO crp_loads"):
+            self.loads[args[:2]] = args[2]
+        elif sql.startswith("DELETE FROM crp_loads WHERE tablename=%s AND cycle=%s"):
+            self.loads.pop(args, None)
+        elif sql.startswith("DELETE FROM crp_loads"):
+            for key in [key for key in self.loads if key[0] == args[0] and key[1] != '']:
+                del self.loads[key]
+        else:
+            self.statements.append((sql, args))
+
+    def fetchall(self):
+        return self.result
+
+
+class StandInLobby(LobbyDownloader):
+
+    incremental = True
+
+    def loadrecords(self, table, wanted):
+        picked = [record for record in records(self.source.open(self.filename(table), 'rb')) if wanted(record)]
+        self.loaded.append((table, picked))
+
+
+class LoadSlicesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cursor = StandInCursor()
+        self.write(ISSUES, BILLS)
+        self.load()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, issues, bills):
+        for name, lines in [('lob_issue.txt', issues), ('lob_bills.txt', bills)]:
+            outfile = open(os.path.join(self.tmpdir, name), 'wb')
+            outfile.writelines(lines)
+            outfile.close()
+
+    def load(self):
+        self.cursor.statements = []
+        lobby = StandInLobby(self.cursor, self.tmpdir)
+        lobby.loaded = []
+        lobby.loadslices('lob_issue')
+        return lobby.loaded
+
+    def cycles(self, table):
+        return sorted([cycle for t, cycle in self.cursor.loads if t == table])
+
+    def test_first_load(self):
+        self.assertEqual(self.cycles('lob_issue'), ['-', '2011', '2012'])
+        self.assertEqual(self.cycles('lob_bills'), ['-', '2011', '2012', '?'])
+
+    def test_unchanged(self):
+        #the issue without a year is saved as '-' and read back as ''
+        self.assertEqual(self.load(), [])
+        self.assertEqual(self.cursor.statements, [])
+
+    def test_changed_child_reloads_its_year(self):
+        self.write(ISSUES, BILLS[:1] + ['|11|,|2|,|112|,|S.22|\r\n'] + BILLS[2:])
+        self.assertEqual(self.load(), [('lob_bills', ['|11|,|2|,|112|,|S.22|\r\n'])])
+        (sql, args), = self.cursor.statements
+        self.assertTrue(sql.startswith("DELETE c FROM crp_lob_bills c JOIN crp_lob_issue p"), sql)
+        self.assertEqual(args, ('2012',))
+
+    def test_changed_parent_reloads_its_children(self):
+        self.write(ISSUES[:2] + ['|3|,|u3|,|DEF|,|Defense|,|Ships|,||\r\n'], BILLS)
+        self.assertEqual(self.load(), [
+            ('lob_issue', ['|3|,|u3|,|DEF|,|Defense|,|Ships|,||\r\n']),
+            ('lob_bills', [BILLS[2]]),
+        ])
+        self.assertEqual([args for sql, args in self.cursor.statements], [('',), ('',)])
+
+    def test_changed_orphan(self):
+        self.write(ISSUES, BILLS[:3] + ['|13|,|98|,|112|,|H.R.98|\r\n'])
+        self.assertEqual(self.load(), [('lob_bills', ['|13|,|98|,|112|,|H.R.98|\r\n'])])
+        (sql, args), = self.cursor.statements
+        self.assertTrue(sql.startswith("DELETE c FROM crp_lob_bills c LEFT JOIN crp_lob_issue p"), sql)
+
+    def test_vanished_year(self):
+        self.write(ISSUES[1:], BILLS[1:])
+        self.assertEqual(self.load(), [('lob_issue', []), ('lob_bills', [])])
+        self.assertEqual([args for sql, args in self.cursor.statements], [('2011',), ('2011',)])
+        self.assertEqual(self.cycles('lob_issue'), ['-', '2012'])
+        self.assertEqual(self.cycles('lob_bills'), ['-', '2012', '?'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import logging
+import unittest
+
+from pipeline import Pipeline
+
+
+class StandInSource(object):
+
+    def refresh(self):
+        pass
+
+
+class StandInLoader(object):
+    """Jobs for a table in each of two cycles, or one job for a file of its own."""
+
+    def __init__(self, jobs, resource):
+        self.source = StandInSource()
+        self._jobs = jobs
+        self._resource = resource
+
+    def jobs(self):
+        return self._jobs
+
+    def resource(self, table, year):
+        return self._resource(table, year)
+
+
+class StandInDownloader(object):
+
+    workers = 2
+
+    def __init__(self, failing):
+        self.failing = failing
+
+    def pending(self, resources, sections, redownload=False):
+        return resources
+
+    def downloads(self, pending, window=None):
+        for res in pending:
+            if res['filename'] in self.failing:
+                res['error'] = IOError('connection reset')
+            yield res
+
+
+class StandInScheduler(object):
+
+    def __init__(self):
+        self.loaded = []
+
+    def jobs(self, loaders):
+        return [(loader, table, year) for loader in loaders for (table, year) in loader.jobs()]
+
+    def pool(self):
+        return None
+
+    def run(self, loaders, jobs, pool=None):
+        for loader, table, year in jobs:
+            self.loaded.append((table, year))
+
+
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.loaders = [
+            StandInLoader([('pacs', '10'), ('pacs', '12')], lambda table, year: 'CampaignFin' + year),
+            StandInLoader([('ids', None)], lambda table, year: 'CRP_IDs'),
+        ]
+        self.resources = [{'filename': name, 'ext': 'zip'} for name in ['CampaignFin12', 'CRP_IDs', 'CampaignFin10']]
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def run_pipeline(self, failing):
+        scheduler = StandInScheduler()
+        pipeline = Pipeline(StandInDownloader(failing), scheduler)
+        try:
+            pipeline.run(self.loaders, self.resources, ['campfin', 'extras'])
+        except IOError, e:
+            return scheduler.loaded, str(e)
+        return scheduler.loaded, None
+
+    def test_everything_arrives(self):
+        loaded, error = self.run_pipeline([])
+        self.assertEqual(sorted(loaded), [('ids', None), ('pacs', '10'), ('pacs', '12')])
+        self.assertEqual(error, None)
+
+    def test_failed_download_skips_only_its_jobs(self):
+        #CRP_IDs fails before CampaignFin10 has arrived; the cycles still load
+        loaded, error = self.run_pipeline(['CRP_IDs'])
+        self.assertEqual(sorted(loaded), [('pacs', '10'), ('pacs', '12')])
+        self.assertTrue('CRP_IDs' in error)
+
+    def test_failed_cycle(self):
+        loaded, error = self.run_pipeline(['CampaignFin12'])
+        self.assertEqual(sorted(loaded), [('ids', None), ('pacs', '10')])
+        self.assertTrue('CampaignFin12' in error)
+
+
+if __name__ == '__main__':
+    unittest.main()
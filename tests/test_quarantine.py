@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from loader import loadcrp
+from quarantine import Quarantine, TooManyRejects
+
+
+class WarningCursor(object):
+    """Stands in for a cursor whose LOAD DATA left warnings; the server lists
+    only the first listed of them, as with max_error_count."""
+
+    def __init__(self, count, listed):
+        self.count = count
+        self.listed = listed
+        self.rowcount = 10
+        self.result = None
+
+    def execute(self, sql):
+        if sql == "SHOW COUNT(*) WARNINGS":
+            self.result = [(self.count,)]
+        elif sql == "SHOW WARNINGS":
+            self.result = [('Warning', 1265, "Data truncated for column 'amount' at row %i" % (i + 1)) for i in range(self.listed)]
+        else:
+            self.result = [None]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+
+class LoadWarningsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def rejects(self):
+        return open(os.path.join(self.tmpdir, 'indivs.rejects')).read().splitlines()
+
+    def test_warnings_recorded(self):
+        quarantine = Quarantine('indivs', self.tmpdir)
+        self.assertEqual(loadcrp(WarningCursor(5, 2), 'indivs12.txt', 'crp_indivs', quarantine=quarantine), 10)
+        quarantine.close()
+        self.assertEqual(quarantine.count, 5)
+        self.assertEqual(quarantine.reasons, {'mysql1265': 2, 'mysql': 3})
+        self.assertEqual(self.rejects()[0], "mysql1265,|Data truncated for column 'amount' at row 1|")
+
+    def test_no_warnings(self):
+        quarantine = Quarantine('indivs', self.tmpdir)
+        loadcrp(WarningCursor(0, 0), 'indivs12.txt', 'crp_indivs', quarantine=quarantine)
+        self.assertEqual(quarantine.count, 0)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'indivs.rejects')))
+
+    def test_limit(self):
+        quarantine = Quarantine('indivs', self.tmpdir, 3)
+        self.assertRaises(TooManyRejects, loadcrp, WarningCursor(5, 5), 'indivs12.txt', 'crp_indivs', quarantine=quarantine)
+
+
+if __name__ == '__main__':
+    unittest.main()
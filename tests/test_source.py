@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from source import RawSource
+
+
+DATA = '|2012|,|0000001|,|SMITH, JOHN|\r\n|2012|,|0000002|,|JONES, ANN|\r\n'
+
+
+class RawSourceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.archives = os.path.join(self.tmpdir, 'download')
+        self.dest = os.path.join(self.tmpdir, 'raw')
+        os.makedirs(self.archives)
+        os.makedirs(self.dest)
+        archive = zipfile.ZipFile(os.path.join(self.archives, 'CampaignFin12.zip'), 'w', zipfile.ZIP_DEFLATED)
+        archive.writestr('indivs12.txt', DATA)
+        archive.close()
+        outfile = open(os.path.join(self.dest, 'pacs12.txt'), 'wb')
+        outfile.write(DATA)
+        outfile.close()
+        self.source = RawSource(self.dest, self.archives)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_zip_member_in_binary_mode(self):
+        #the mode the indivs loaders use
+        self.assertEqual(self.source.open('indivs12.txt', 'rb').read(), DATA)
+        self.assertEqual(self.source.open('INDIVS12.TXT').read(), DATA)
+
+    def test_file_on_disk(self):
+        self.assertEqual(self.source.open('pacs12.txt', 'rb').read(), DATA)
+
+    def test_filepath(self):
+        self.assertEqual(self.source.filepath('indivs12.txt'), None)
+        self.assertEqual(self.source.filepath('pacs12.txt'), os.path.join(self.dest, 'pacs12.txt'))
+
+    def test_localpath_pipes_zip_members(self):
+        with self.source.localpath('indivs12.txt') as path:
+            self.assertEqual(open(path, 'rb').read(), DATA)
+
+    def test_fingerprint(self):
+        self.assertTrue(self.source.fingerprint('indivs12.txt').startswith('crc:'))
+        self.assertTrue(self.source.fingerprint('pacs12.txt').startswith('md5:'))
+        self.assertEqual(self.source.fingerprint('cands12.txt'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
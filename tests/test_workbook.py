@@ -0,0 +1,57 @@
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+import workbook
+
+
+#what pyExcelerator.parse_xls gives: (sheet name, {(row, column): value})
+SHEETS = [
+    (u'Members 112th', {(0, 0): u'CID', (0, 2): u'CRPName', (2, 0): u'N00000001', (2, 2): u'Smith (R)', (2, 3): 1.0}),
+    (u'Ignored', {(0, 0): u'x'}),
+    (u'CRP Industry Codes', {(0, 0): u'Catcode', (0, 1): u'Catname', (1, 0): u'A1000', (1, 1): u'Crop production'}),
+]
+
+MEMBERS = [['CID', '', 'CRPName', ''], [], ['N00000001', '', 'Smith (R)', '1']]
+CODES = [['Catcode', 'Catname'], ['A1000', 'Crop production']]
+
+
+class ReadSheetsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'CRP_IDs.xls')
+        open(self.path, 'wb').write('not parsed, pyExcelerator is a stand-in')
+        self.xlrd = workbook.xlrd
+        self.pyexcelerator = sys.modules.get('pyExcelerator')
+        stand_in = types.ModuleType('pyExcelerator')
+        stand_in.parse_xls = lambda path: SHEETS
+        sys.modules['pyExcelerator'] = stand_in
+        workbook.xlrd = None
+
+    def tearDown(self):
+        workbook.xlrd = self.xlrd
+        if self.pyexcelerator is None:
+            del sys.modules['pyExcelerator']
+        else:
+            sys.modules['pyExcelerator'] = self.pyexcelerator
+        shutil.rmtree(self.tmpdir)
+
+    def test_sheets_read_after_the_last(self):
+        #every sheet's rows are its own, even once the generator has moved on
+        sheets = list(workbook.readsheets(self.path, ['Members', 'CRP']))
+        self.assertEqual([(name, list(rows)) for name, rows in sheets], [('Members 112th', MEMBERS), ('CRP Industry Codes', CODES)])
+
+    def test_cachedsheets(self):
+        cache_path = os.path.join(self.tmpdir, 'cache')
+        expected = [('Members 112th', MEMBERS), ('CRP Industry Codes', CODES)]
+        self.assertEqual(workbook.cachedsheets(self.path, ['Members', 'CRP'], cache_path), expected)
+        sys.modules['pyExcelerator'].parse_xls = None
+        self.assertEqual(workbook.cachedsheets(self.path, ['Members', 'CRP'], cache_path), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
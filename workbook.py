@@ -0,0 +1,114 @@
+"""
+Read selected sheets of an Excel workbook as rows of strings.
+
+xlrd is used if it is installed: opened on_demand, it only parses the sheets
+that are asked for, a row at a time. Otherwise the whole workbook goes
+through pyExcelerator as before. Parsed sheets can be cached, keyed on the
+file's md5, so an unchanged workbook isn't parsed again.
+"""
+
+import cPickle
+import glob
+import logging
+import os
+
+try:
+    import xlrd
+except ImportError:
+    xlrd = None
+
+from manifest import md5file
+
+
+def cellvalue(v):
+    if isinstance(v, unicode):
+        return v.encode('cp866', 'backslashreplace')
+    if isinstance(v, float) and v.is_integer():
+        #xlrd reads every number as a float; pyExcelerator gives whole ones as ints
+        v = int(v)
+    return str(v)
+
+
+def trimmed(row):
+    #a row with nothing in it comes out empty, whatever the sheet's width
+    for v in row:
+        if v != '':
+            return row
+    return []
+
+
+def wanted(name, prefixes):
+    return [prefix for prefix in prefixes if name.startswith(prefix)]
+
+
+def xlrdrows(sheet):
+    for i in xrange(sheet.nrows):
+        yield trimmed([cellvalue(v) for v in sheet.row_values(i)])
+
+
+def gridrows(rows, width):
+    #rows is {row: {column: value}}; missing cells are blank, missing rows empty
+    for i in xrange(max(rows) + 1):
+        if i in rows:
+            yield [rows[i].get(j, '') for j in xrange(width)]
+        else:
+            yield []
+
+
+def xlrdsheets(path, prefixes):
+    book = xlrd.open_workbook(path, on_demand=True)
+    try:
+        for sheet_name in book.sheet_names():
+            name = sheet_name.encode('cp866', 'backslashreplace')
+            if not wanted(name, prefixes):
+                continue
+            sheet = book.sheet_by_name(sheet_name)
+            yield name, xlrdrows(sheet)
+            book.unload_sheet(sheet_name)
+    finally:
+        book.release_resources()
+
+
+def pyexceleratorsheets(path, prefixes):
+    import pyExcelerator
+    for sheet_name, values in pyExcelerator.parse_xls(path):
+        name = sheet_name.encode('cp866', 'backslashreplace')
+        if not wanted(name, prefixes) or not values:
+            continue
+        rows = {}
+        for (row_idx, col_idx), v in values.iteritems():
+            rows.setdefault(row_idx, {})[col_idx] = cellvalue(v)
+        width = max([col_idx for row_idx, col_idx in values]) + 1
+        yield name, gridrows(rows, width)
+
+
+def readsheets(path, prefixes):
+    """Yields (sheet name, rows) for each sheet whose name starts with one of
+    prefixes. Empty rows are empty lists; the rest are as wide as the sheet.
+    Each sheet's rows can be read at any time, not just before the next sheet."""
+    if xlrd:
+        return xlrdsheets(path, prefixes)
+    return pyexceleratorsheets(path, prefixes)
+
+
+def cachedsheets(path, prefixes, cache_path):
+    """readsheets, but kept in cache_path after the first parse of a given file."""
+    key = md5file(path)
+    cached = os.path.join(cache_path, "%s-%s.pickle" % (os.path.basename(path), key))
+    if os.path.exists(cached):
+        sheets = cPickle.load(open(cached, 'rb'))
+        if sorted(sheets['prefixes']) == sorted(prefixes):
+            logging.info("Using sheets of %s parsed earlier" % path)
+            return sheets['sheets']
+
+    sheets = [(name, list(rows)) for name, rows in readsheets(path, prefixes)]
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_path)
+    for stale in glob.glob(os.path.join(cache_path, os.path.basename(path) + "-*.pickle")):
+        os.remove(stale)
+    tmp_path = "%s.%i.tmp" % (cached, os.getpid())
+    outfile = open(tmp_path, 'wb')
+    cPickle.dump({'prefixes': prefixes, 'sheets': sheets}, outfile, 2)
+    outfile.close()
+    os.rename(tmp_path, cached)
+    return sheets